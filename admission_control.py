@@ -0,0 +1,55 @@
+import logging
+from typing import Optional
+
+logger = logging.getLogger("ray.serve")
+
+BUFFER_POLICIES = ("drop_oldest", "reject", "slow_down")
+
+
+class AdmissionController:
+    """
+    Server-wide limits of one ingress replica: how many sessions it accepts, how many seconds of audio may
+    be waiting on ASR before new sessions are refused, how much unprocessed audio each session may buffer,
+    how many seconds of audio each session's ring buffer holds and how many channels a session may declare.
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, max_inflight_asr_seconds: Optional[float] = None,
+                 max_session_buffer_seconds: Optional[float] = None, buffer_policy: str = "drop_oldest",
+                 ring_buffer_seconds: float = 60.0, max_channels: int = 2):
+        if buffer_policy not in BUFFER_POLICIES:
+            raise ValueError(f"Unsupported buffer policy: {buffer_policy}")
+        if max_session_buffer_seconds is not None and ring_buffer_seconds < 2 * max_session_buffer_seconds:
+            # slow_down lets the pending audio grow to twice the limit, on top of the scratch buffer
+            raise ValueError(f"Ring buffer of {ring_buffer_seconds}s cannot hold twice the session buffer "
+                             f"limit of {max_session_buffer_seconds}s")
+
+        self.max_sessions = max_sessions
+        self.max_inflight_asr_seconds = max_inflight_asr_seconds
+        self.max_session_buffer_seconds = max_session_buffer_seconds
+        self.buffer_policy = buffer_policy
+        self.ring_buffer_seconds = ring_buffer_seconds
+        self.max_channels = max_channels
+
+        self.active_sessions = 0
+        self.inflight_asr_seconds = 0.0
+
+    def try_admit(self) -> Optional[str]:
+        """
+        Registers a new session, returns the reason it was refused or None when it was admitted
+        """
+        if self.max_sessions is not None and self.active_sessions >= self.max_sessions:
+            return "max_sessions"
+        if self.max_inflight_asr_seconds is not None and self.inflight_asr_seconds >= self.max_inflight_asr_seconds:
+            return "max_inflight_asr_seconds"
+
+        self.active_sessions += 1
+        return None
+
+    def release(self):
+        self.active_sessions -= 1
+
+    def asr_started(self, audio_seconds: float):
+        self.inflight_asr_seconds += audio_seconds
+
+    def asr_finished(self, audio_seconds: float):
+        self.inflight_asr_seconds = max(0.0, self.inflight_asr_seconds - audio_seconds)
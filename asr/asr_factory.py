@@ -1,15 +1,25 @@
-from asr.asr_interface import ASRInterface
-from asr.faster_whisper_asr import FasterWhisperASR
-from asr.whisper_asr import WhisperASR
+from typing import Any, Dict, Optional
+
+from ray.serve import Application
 
 
 class ASRFactory:
 
     @staticmethod
-    def create_asr_pipeline(type: str, **kwargs) -> ASRInterface:
+    def create_asr_pipeline(type: str, deployment_options: Optional[Dict[str, Any]] = None, **kwargs) -> Application:
+        # Backends are imported only when selected, each pulls in its own model libraries
         if type == "whisper":
-            return WhisperASR(**kwargs)
+            from asr.whisper_asr import WhisperASR
+            deployment = WhisperASR
         elif type == "faster_whisper":
-            return FasterWhisperASR(**kwargs)
+            from asr.faster_whisper_asr import FasterWhisperASR
+            deployment = FasterWhisperASR
+        elif type == "stub":
+            from asr.stub_asr import StubASR
+            deployment = StubASR
         else:
             raise ValueError(f"Unknown ASR pipeline type: {type}")
+
+        if deployment_options:
+            deployment = deployment.options(**deployment_options)
+        return deployment.bind(**kwargs)
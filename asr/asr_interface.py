@@ -1,9 +1,22 @@
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List
 
-
-# from client import Client
+from audio_request import AudioRequest
 
 
 class ASRInterface:
-    async def transcribe(self, client) -> Dict[str, Any]:
+    async def transcribe(self, request: AudioRequest) -> Dict[str, Any]:
         raise NotImplementedError("This method should be implemented by sub classes")
+
+    async def transcribe_channels(self, requests: List[AudioRequest]) -> List[Dict[str, Any]]:
+        """
+        Transcribes the chunks of the channels of a multi-channel session sent as one request, results in the
+        same order. Runs them through transcribe concurrently, where the batching deployments decode them together.
+        """
+        return list(await asyncio.gather(*(self.transcribe(request) for request in requests)))
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Model, memory and latency details of the replica, reported by the ingress
+        """
+        return {}
@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from ray.serve import Application
+
+from asr.asr_factory import ASRFactory
+
+
+@dataclass
+class ASRModelVariant:
+    name: str
+    asr_type: str = "faster_whisper"
+    num_replicas: int = 1
+    ray_actor_options: Optional[Dict[str, Any]] = None
+    max_ongoing_requests: Optional[int] = None
+    # Passed to reconfigure, batching settings for faster-whisper
+    user_config: Optional[Dict[str, Any]] = None
+    # Constructor arguments of the deployment, model_size, compute_type and device for faster-whisper
+    asr_args: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def deployment_name(self) -> str:
+        return f"ASR_{self.name}"
+
+
+class ASRModelRegistry:
+    """
+    Named ASR variants, each deployed as its own deployment with its own replica count, that sessions pick
+    with "asr_model" in their config message. Configured by the asr_models args of serve_config.yaml:
+
+        asr_models:
+          default: tiny-int8
+          variants:
+            tiny-int8: {model_size: tiny, compute_type: int8, num_replicas: 2}
+            small-int8_float32: {model_size: small, compute_type: int8_float32}
+
+    Variant keys other than asr_type, num_replicas, ray_actor_options, max_ongoing_requests and user_config are
+    constructor arguments. max_ongoing_requests and user_config default to the registry's own, so batching
+    settings can be given once for all variants. Each variant is deployed as ASR_<name>.
+    """
+
+    def __init__(self, variants: Dict[str, ASRModelVariant], default: Optional[str] = None):
+        if not variants:
+            raise ValueError("The ASR model registry needs at least one variant")
+        default = default or next(iter(variants))
+        if default not in variants:
+            raise ValueError(f"Default ASR model {default} is not a registered variant")
+
+        self.variants = variants
+        self.default = default
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], asr_type: str, asr_args: Dict[str, Any]) -> "ASRModelRegistry":
+        variants = {}
+        for name, variant_config in config.get("variants", {}).items():
+            variant_config = dict(variant_config)
+            max_ongoing_requests = variant_config.pop("max_ongoing_requests", config.get("max_ongoing_requests"))
+            variants[name] = ASRModelVariant(
+                name=name,
+                asr_type=variant_config.pop("asr_type", asr_type),
+                num_replicas=int(variant_config.pop("num_replicas", 1)),
+                ray_actor_options=variant_config.pop("ray_actor_options", None),
+                max_ongoing_requests=int(max_ongoing_requests) if max_ongoing_requests is not None else None,
+                user_config=variant_config.pop("user_config", config.get("user_config")),
+                # Arguments shared by all variants, such as the inference pool, under the variant's own
+                asr_args={**asr_args, **variant_config, "variant_name": name},
+            )
+        return cls(variants, config.get("default"))
+
+    def build(self) -> Dict[str, Application]:
+        applications = {}
+        for name, variant in self.variants.items():
+            deployment_options = {"name": variant.deployment_name, "num_replicas": variant.num_replicas}
+            if variant.ray_actor_options is not None:
+                deployment_options["ray_actor_options"] = variant.ray_actor_options
+            if variant.max_ongoing_requests is not None:
+                deployment_options["max_ongoing_requests"] = variant.max_ongoing_requests
+            if variant.user_config is not None:
+                deployment_options["user_config"] = variant.user_config
+            applications[name] = ASRFactory.create_asr_pipeline(variant.asr_type, deployment_options,
+                                                                **variant.asr_args)
+        return applications
@@ -1,15 +1,27 @@
+import bisect
+import dataclasses
+import logging
 import os
+import time
+
+import numpy as np
 
 from asr.asr_interface import ASRInterface
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.transcribe import restore_speech_timestamps
 
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 from ray import serve
 
-from audio_utils import save_audio_to_file
+from audio_request import AudioRequest
+from audio_utils import save_audio_to_file, float32_to_pcm, warmup_audio
+from metrics import get_metrics
+from request_routing import PendingAudioStats, audio_seconds_router_config
+from serve_utils import InferenceExecutor, WarmupReadiness, get_assigned_cpus, get_rss_bytes, parse_flag
+from transcription_cache import TranscriptionCache
 
-# from client import Client
+logger = logging.getLogger("ray.serve")
 
 language_codes = {
     "afrikaans": "af",
@@ -117,29 +129,279 @@ language_codes = {
 
 @serve.deployment(
     ray_actor_options={"num_cpus": 1},
+    request_router_config=audio_seconds_router_config(),
 )
-class FasterWhisperASR(ASRInterface):
+class FasterWhisperASR(WarmupReadiness, PendingAudioStats, ASRInterface):
 
     def __init__(self, **kwargs):
+        init_start = time.time()
+        # A size, a Hugging Face repository or a local directory of a CTranslate2 model
         model_size = kwargs.get("model_size", "tiny")
-        self.asr_pipeline = WhisperModel(model_size, device="cpu", compute_type="float32")
+        self.model_size = model_size
+        self.compute_type = kwargs.get("compute_type", "float32")
+        self.device = kwargs.get("device", "cpu")
+        # Name of the model registry variant, what the metrics are tagged with
+        self.model_label = kwargs.get("variant_name", model_size)
+        num_workers = kwargs.get("num_workers", get_assigned_cpus())
+        cpu_threads = kwargs.get("cpu_threads", max(1, get_assigned_cpus() // num_workers))
+
+        # Models are downloaded once into the cache directory, with local_files_only a replica never downloads
+        model_cache_dir = os.environ.get("MODEL_CACHE_DIR")
+        if not model_cache_dir:
+            model_cache_dir = kwargs.get("model_cache_dir")
+
+        rss_before = get_rss_bytes()
+        self.asr_pipeline = WhisperModel(model_size, device=self.device, compute_type=self.compute_type,
+                                         cpu_threads=cpu_threads, num_workers=num_workers,
+                                         download_root=model_cache_dir,
+                                         local_files_only=bool(kwargs.get("local_files_only", False)))
+        self.model_memory_bytes = get_rss_bytes() - rss_before
+        # num_workers lets ctranslate2 run that many transcriptions in parallel, one per pool thread
+        self.executor = InferenceExecutor(kwargs.get("inference_pool_size", num_workers), "FasterWhisperASR")
+        self.batched_pipeline = BatchedInferencePipeline(model=self.asr_pipeline)
+        self.batching_enabled = False
+
+        self.save_audio_debug = os.environ.get("SAVE_AUDIO_DEBUG")
+        if not self.save_audio_debug:
+            self.save_audio_debug = kwargs.get("save_audio_debug", False)
+        self.save_audio_debug = parse_flag(self.save_audio_debug)
+
+        cache_max_bytes = os.environ.get("ASR_CACHE_MAX_BYTES")
+        if not cache_max_bytes:
+            cache_max_bytes = kwargs.get("cache_max_bytes", 0)
+        cache_actor_name = os.environ.get("ASR_CACHE_ACTOR_NAME")
+        if not cache_actor_name:
+            cache_actor_name = kwargs.get("cache_actor_name")
+        self.cache = TranscriptionCache(int(cache_max_bytes), cache_actor_name,
+                                        kwargs.get("cache_actor_max_bytes")) if int(cache_max_bytes) > 0 else None
+
+        # The warmup decode also measures the latency of one chunk
+        probe_chunk_seconds = float(kwargs.get("probe_chunk_seconds", 3.0))
+        self.chunk_latency_seconds = self.warm_up(
+            f"FasterWhisperASR {self.model_label}", init_start,
+            lambda: self._transcribe(warmup_audio(probe_chunk_seconds), "en",
+                                     decode_options={"beam_size": 1, "word_timestamps": True}))
+        get_metrics().model_memory_bytes.set(self.model_memory_bytes, tags={"model": self.model_label})
+        get_metrics().model_chunk_latency.set(self.chunk_latency_seconds, tags={"model": self.model_label})
+        logger.info(f"ASR model {self.model_label} ({model_size}, {self.compute_type} on {self.device}): "
+                    f"{self.model_memory_bytes / 2 ** 20:.0f}MiB, {self.chunk_latency_seconds * 1000:.0f}ms per "
+                    f"{probe_chunk_seconds}s chunk")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_label,
+            "model_size": self.model_size,
+            "compute_type": self.compute_type,
+            "device": self.device,
+            "memory_bytes": self.model_memory_bytes,
+            "chunk_latency_seconds": self.chunk_latency_seconds,
+        }
+
+    def reconfigure(self, config: Dict[str, Any]):
+        batching = config.get("batching", {})
+        self.batching_enabled = batching.get("enabled", False)
+        self.transcribe_batch.set_max_batch_size(batching.get("max_batch_size", 8))
+        self.transcribe_batch.set_batch_wait_timeout_s(batching.get("batch_wait_timeout_s", 0.05))
+
+    async def transcribe(self, request: AudioRequest) -> Dict[str, Any]:
+        request.validate()
+        async with self.pending_audio(request.audio_seconds):
+            if self.cache is None:
+                return await self._transcribe_uncached(request)
+
+            audio = await request.get_audio()
+            cache_key = TranscriptionCache.key(audio, model_size=self.model_size, compute_type=self.compute_type,
+                                               language=self._get_language_code(request.language),
+                                               speech_segments=request.speech_segments,
+                                               decode_options=self._decode_options(request.decode_options))
+            result = await self.cache.get(cache_key)
+            if result is not None:
+                get_metrics().audio_seconds.inc(len(audio) / request.sampling_rate,
+                                                tags={"stage": "asr_cache_hit", "model_size": self.model_label})
+                return result
+
+            result = await self._transcribe_uncached(request)
+            self.cache.put(cache_key, result)
+            return result
+
+    async def _transcribe_uncached(self, request: AudioRequest) -> Dict[str, Any]:
+        if self.batching_enabled:
+            return await self.transcribe_batch(request)
+
+        audio = await request.get_audio()
+        if self.save_audio_debug:
+            await save_audio_to_file(float32_to_pcm(audio), request.file_name)
+
+        return await self.executor.run(self._transcribe, audio, self._get_language_code(request.language),
+                                       request.speech_segments, self._decode_options(request.decode_options))
+
+    async def transcribe_channels(self, requests: List[AudioRequest]) -> List[Dict[str, Any]]:
+        if self.batching_enabled or self.cache is not None:
+            # Batched with the other sessions' chunks, or looked up one by one
+            return await super().transcribe_channels(requests)
+
+        for request in requests:
+            request.validate()
+        async with self.pending_audio(sum(request.audio_seconds for request in requests)):
+            return await self._run_batch(requests)
+
+    @serve.batch(max_batch_size=8, batch_wait_timeout_s=0.05)
+    async def transcribe_batch(self, requests: List[AudioRequest]) -> List[Dict[str, Any]]:
+        return await self._run_batch(requests)
+
+    async def _run_batch(self, requests: List[AudioRequest]) -> List[Dict[str, Any]]:
+        audios = [await request.get_audio() for request in requests]
+        if self.save_audio_debug:
+            for request, audio in zip(requests, audios):
+                await save_audio_to_file(float32_to_pcm(audio), request.file_name)
+
+        languages = [self._get_language_code(request.language) for request in requests]
+        speech_segments = [request.speech_segments for request in requests]
+        decode_options = [self._decode_options(request.decode_options) for request in requests]
+        return await self.executor.run(self._transcribe_batch, audios, languages, speech_segments, decode_options)
+
+    def _transcribe(self, audio: np.ndarray, language: Optional[str],
+                    speech_segments: Optional[List[Dict[str, float]]] = None,
+                    decode_options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        start = time.time()
+        speech_audio, speech_chunks = self._speech_only(audio, speech_segments)
+        segments, info = self.asr_pipeline.transcribe(speech_audio, language=language,
+                                                      **self._decode_options(decode_options))
+        result = self._build_result(info.language, info.language_probability,
+                                    self._restore_timestamps(list(segments), speech_chunks))
+        get_metrics().observe_inference("asr_inference", self.model_label, time.time() - start,
+                                        len(speech_audio) / self.asr_pipeline.feature_extractor.sampling_rate)
+        return result
+
+    def _transcribe_batch(self, audios: List[np.ndarray], languages: List[Optional[str]],
+                          speech_segments: List[Optional[List[Dict[str, float]]]],
+                          decode_options: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        start = time.time()
+        chunk_samples = self.asr_pipeline.feature_extractor.chunk_length * self.asr_pipeline.feature_extractor.sampling_rate
+        results: List[Optional[Dict[str, Any]]] = [None] * len(audios)
+        # Requests are batched with the others of the same language and decode options
+        groups: Dict[Tuple[str, str], List[int]] = {}
+        probabilities = [1.0] * len(audios)
+
+        speech_audios = list(audios)
+        speech_chunks: List[Optional[List[Dict[str, int]]]] = [None] * len(audios)
+
+        for i, (audio, language, segments, options) in enumerate(zip(audios, languages, speech_segments,
+                                                                      decode_options)):
+            if len(audio) > chunk_samples:
+                # Longer than one decoding window, let the sequential path handle the seeking
+                results[i] = self._transcribe(audio, language, segments, options)
+                continue
+
+            speech_audios[i], speech_chunks[i] = self._speech_only(audio, segments)
+            audio = speech_audios[i]
+
+            if language is None:
+                language, probabilities[i], _ = self.asr_pipeline.detect_language(audio)
+            groups.setdefault((language, repr(sorted(options.items()))), []).append(i)
+
+        for (language, _), indices in groups.items():
+            grouped_segments = self._transcribe_group([speech_audios[i] for i in indices], language,
+                                                      decode_options[indices[0]])
+            for i, segments in zip(indices, grouped_segments):
+                results[i] = self._build_result(language, probabilities[i],
+                                                self._restore_timestamps(segments, speech_chunks[i]))
+
+        get_metrics().observe_inference("asr_batch_inference", self.model_label, time.time() - start,
+                                        sum(len(audio) for audio in speech_audios) / self.asr_pipeline.feature_extractor.sampling_rate)
+        return results
+
+    def _transcribe_group(self, audios: List[np.ndarray], language: str,
+                          decode_options: Dict[str, Any]) -> List[List[Any]]:
+        sampling_rate = self.asr_pipeline.feature_extractor.sampling_rate
+        # collect_chunks merges neighbouring clips while they fit in one window, so every clip is padded past
+        # half a window to keep each session's audio in its own batch item
+        min_clip_samples = self.asr_pipeline.feature_extractor.chunk_length * sampling_rate // 2 + 1
+
+        padded_audios = []
+        offsets = []
+        clip_timestamps = []
+        offset = 0
+        for audio in audios:
+            length = max(len(audio), min_clip_samples)
+            padded_audios.append(np.pad(audio, (0, length - len(audio))))
+            offsets.append(offset / sampling_rate)
+            clip_timestamps.append({"start": offset / sampling_rate, "end": (offset + length) / sampling_rate})
+            offset += length
+
+        segments, _ = self.batched_pipeline.transcribe(np.concatenate(padded_audios), language=language,
+                                                       clip_timestamps=clip_timestamps, batch_size=len(audios),
+                                                       **decode_options)
+
+        grouped_segments = [[] for _ in audios]
+        for segment in segments:
+            index = max(bisect.bisect_right(offsets, segment.start + 1e-3) - 1, 0)
+            offset = offsets[index]
+            grouped_segments[index].append(dataclasses.replace(
+                segment,
+                start=segment.start - offset,
+                end=segment.end - offset,
+                words=[dataclasses.replace(w, start=w.start - offset, end=w.end - offset)
+                       for w in segment.words] if segment.words else None,
+            ))
+
+        return grouped_segments
+
+    def _speech_only(self, audio: np.ndarray, speech_segments: Optional[List[Dict[str, float]]]
+                     ) -> Tuple[np.ndarray, Optional[List[Dict[str, int]]]]:
+        """
+        Concatenates the speech regions of the audio, returns the speech audio and the sample chunks needed to
+        map timestamps back, or the audio unchanged when there are no regions
+        """
+        if not speech_segments:
+            return audio, None
+
+        sampling_rate = self.asr_pipeline.feature_extractor.sampling_rate
+        speech_chunks = []
+        for segment in speech_segments:
+            chunk_start = max(int(segment["start"] * sampling_rate), 0)
+            chunk_end = min(int(segment["end"] * sampling_rate), len(audio))
+            if chunk_end > chunk_start:
+                speech_chunks.append({"start": chunk_start, "end": chunk_end})
+        if not speech_chunks:
+            return audio, None
+
+        speech_audio = np.concatenate([audio[chunk["start"]:chunk["end"]] for chunk in speech_chunks])
+        get_metrics().audio_seconds.inc((len(audio) - len(speech_audio)) / sampling_rate,
+                                        tags={"stage": "asr_skipped_silence", "model_size": self.model_label})
+        return speech_audio, speech_chunks
 
-    async def transcribe(self, client) -> Dict[str, Any]:
-        filepath = await save_audio_to_file(client.scratch_buffer, client.get_file_name())
+    def _restore_timestamps(self, segments: List[Any], speech_chunks: Optional[List[Dict[str, int]]]) -> List[Any]:
+        if speech_chunks is None:
+            return segments
+        return list(restore_speech_timestamps(segments, speech_chunks,
+                                              self.asr_pipeline.feature_extractor.sampling_rate))
 
-        language = None if client.config["language"] is None else language_codes.get(client.config["language"].lower())
-        segments, info = self.asr_pipeline.transcribe(filepath, word_timestamps=True, language=language)
+    @staticmethod
+    def _decode_options(decode_options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        The request's decode options, word timestamps with the library defaults for requests without any
+        """
+        return {"word_timestamps": True, **(decode_options or {})}
 
-        output = list(segments)
-        os.remove(filepath)
+    @staticmethod
+    def _get_language_code(language: Optional[str]) -> Optional[str]:
+        if language is None:
+            return None
+        language = language.lower()
+        # Accepts names and codes, a session's locked language comes back as the code Whisper reported
+        return language if language in language_codes.values() else language_codes.get(language)
 
+    @staticmethod
+    def _build_result(language: str, language_probability: float, output: List[Any]) -> Dict[str, Any]:
+        # Segments have no words when the decode profile turned word timestamps off
         flattened_words = [
-            word for segment in output for word in segment.words
+            word for segment in output for word in segment.words or []
         ]
 
         result = {
-            "language": info.language,
-            "language_probability": info.language_probability,
+            "language": language,
+            "language_probability": language_probability,
             "text": ' '.join([s.text.strip() for s in output]),  # Use 'output' instead of 'segments'
             "words": [
                 {"word": w.word, "start": w.start, "end": w.end, "probability": w.probability} for w in flattened_words
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import random
+import time
+
+from typing import Dict, Any
+
+from ray import serve
+
+from asr.asr_interface import ASRInterface
+from audio_request import AudioRequest
+from metrics import get_metrics
+from request_routing import PendingAudioStats, audio_seconds_router_config
+
+
+@serve.deployment(
+    ray_actor_options={"num_cpus": 0.1},
+    request_router_config=audio_seconds_router_config(),
+)
+class StubASR(PendingAudioStats, ASRInterface):
+    """
+    Stand-in for the Whisper deployments with a fixed, configurable latency, so the ingress, buffering and Ray
+    plumbing can be benchmarked without downloading a model
+    """
+
+    def __init__(self, **kwargs):
+        self.fixed_latency = float(os.environ.get("STUB_ASR_LATENCY_SECONDS") or kwargs.get("latency_seconds", 0.2))
+        self.latency_per_audio_second = float(kwargs.get("latency_per_audio_second", 0.02))
+        self.jitter_seconds = float(kwargs.get("jitter_seconds", 0.0))
+        self.words_per_second = float(kwargs.get("words_per_second", 2.0))
+        self.language = kwargs.get("language", "en")
+
+    async def transcribe(self, request: AudioRequest) -> Dict[str, Any]:
+        request.validate()
+        audio = await request.get_audio()
+        audio_seconds = len(audio) / request.sampling_rate
+        if request.speech_segments:
+            audio_seconds = sum(min(s["end"], audio_seconds) - s["start"] for s in request.speech_segments)
+
+        start = time.time()
+        latency = self.fixed_latency + self.latency_per_audio_second * audio_seconds
+        if self.jitter_seconds > 0:
+            latency += random.uniform(0, self.jitter_seconds)
+        async with self.pending_audio(audio_seconds):
+            await asyncio.sleep(latency)
+        get_metrics().observe_inference("asr_inference", "stub", time.time() - start, audio_seconds)
+
+        num_words = int(audio_seconds * self.words_per_second)
+        word_seconds = audio_seconds / num_words if num_words else 0.0
+        words = [
+            {"word": f" word{i}", "start": i * word_seconds, "end": (i + 1) * word_seconds, "probability": 1.0}
+            for i in range(num_words)
+        ]
+        return {
+            "language": self.language,
+            "language_probability": 1.0,
+            "text": ' '.join(w["word"].strip() for w in words),
+            "words": words if (request.decode_options or {}).get("word_timestamps", True) else [],
+        }
@@ -1,33 +1,259 @@
-from asr.asr_interface import ASRInterface
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from huggingface_hub import snapshot_download
+from ray import serve
 from transformers import pipeline
-from audio_utils import save_audio_to_file
+from transformers.models.whisper.tokenization_whisper import TO_LANGUAGE_CODE
 
-import os
-from typing import Dict, Any
+from asr.asr_interface import ASRInterface
+from audio_request import AudioRequest
+from audio_utils import save_audio_to_file, float32_to_pcm, warmup_audio
+from metrics import get_metrics
+from request_routing import PendingAudioStats, audio_seconds_router_config
+from serve_utils import InferenceExecutor, WarmupReadiness, get_assigned_cpus, get_rss_bytes, parse_flag
 
+logger = logging.getLogger("ray.serve")
 
-# from client import Client
+# Decode options and the generate() arguments of transformers Whisper they map to, word_timestamps picks the
+# pipeline's return_timestamps and best_of has no counterpart
+GENERATE_OPTIONS = {
+    "beam_size": "num_beams",
+    "temperature": "temperature",
+    "condition_on_previous_text": "condition_on_prev_tokens",
+    "no_speech_threshold": "no_speech_threshold",
+    "log_prob_threshold": "logprob_threshold",
+    "compression_ratio_threshold": "compression_ratio_threshold",
+}
 
 
-class WhisperASR(ASRInterface):
+@serve.deployment(
+    ray_actor_options={"num_cpus": 1},
+    request_router_config=audio_seconds_router_config(),
+)
+class WhisperASR(WarmupReadiness, PendingAudioStats, ASRInterface):
+    """
+    Hugging Face transformers Whisper, with results in the FasterWhisperASR schema so the two backends can be
+    benchmarked against each other. Requests from all sessions are batched through the pipeline, grouped by
+    language and decode options, and audio longer than chunk_length_s is decoded in overlapping chunks. The
+    pipeline has no word probabilities, words carry None. Decode options map onto generate() through
+    GENERATE_OPTIONS, options without a counterpart such as best_of are ignored with a warning.
+    """
 
     def __init__(self, **kwargs):
+        init_start = time.time()
         model_name = kwargs.get("model_name", "openai/whisper-tiny")
-        self.asr_pipeline = pipeline("automatic-speech-recognition", model=model_name, device="cpu")
-
-    async def transcribe(self, client) -> Dict[str, Any]:
-        filepath = await save_audio_to_file(client.scratch_buffer, client.get_file_name())
-
-        if client.config["language"] is not None:
-            output = self.asr_pipeline(filepath, generate_kwargs={"language": client.config["language"]})["text"]
-        else:
-            output = self.asr_pipeline(filepath)["text"]
-        os.remove(filepath)
-
-        result = {
-            "language": "UNSUPPORTED_BY_HUGGINGFACE_WHISPER",
-            "language_probability": None,
-            "text": output.strip(),
-            "words": "UNSUPPORTED_BY_HUGGINGFACE_WHISPER",
+        self.model_name = model_name
+        self.model_label = kwargs.get("variant_name", model_name.rsplit("/", 1)[-1])
+        # Decode options already warned about
+        self.ignored_options = set()
+        self.chunk_length_s = float(kwargs.get("chunk_length_s", 30.0))
+
+        model_cache_dir = os.environ.get("MODEL_CACHE_DIR")
+        if not model_cache_dir:
+            model_cache_dir = kwargs.get("model_cache_dir")
+
+        inference_pool_size = kwargs.get("inference_pool_size", 1)
+        torch.set_num_threads(kwargs.get("cpu_threads", max(1, get_assigned_cpus() // inference_pool_size)))
+        self.executor = InferenceExecutor(inference_pool_size, "WhisperASR")
+
+        model_path = snapshot_download(model_name, cache_dir=model_cache_dir,
+                                       local_files_only=bool(kwargs.get("local_files_only", False)))
+        rss_before = get_rss_bytes()
+        self.asr_pipeline = pipeline("automatic-speech-recognition", model=model_path, device="cpu")
+        self.model_memory_bytes = get_rss_bytes() - rss_before
+        self.sampling_rate = self.asr_pipeline.feature_extractor.sampling_rate
+        # Language token id -> language code, for detection
+        lang_to_id = self.asr_pipeline.model.generation_config.lang_to_id
+        self.language_tokens = {token_id: token.strip("<|>") for token, token_id in lang_to_id.items()}
+
+        self.save_audio_debug = os.environ.get("SAVE_AUDIO_DEBUG")
+        if not self.save_audio_debug:
+            self.save_audio_debug = kwargs.get("save_audio_debug", False)
+        self.save_audio_debug = parse_flag(self.save_audio_debug)
+
+        # The warmup decode also measures the latency of one chunk
+        probe_chunk_seconds = float(kwargs.get("probe_chunk_seconds", 3.0))
+        self.chunk_latency_seconds = self.warm_up(
+            f"WhisperASR {self.model_label}", init_start,
+            lambda: self._transcribe_batch([warmup_audio(probe_chunk_seconds)], ["en"], [None]))
+        get_metrics().model_memory_bytes.set(self.model_memory_bytes, tags={"model": self.model_label})
+        get_metrics().model_chunk_latency.set(self.chunk_latency_seconds, tags={"model": self.model_label})
+        logger.info(f"ASR model {self.model_label} ({model_name} on cpu): {self.model_memory_bytes / 2 ** 20:.0f}MiB, "
+                    f"{self.chunk_latency_seconds * 1000:.0f}ms per {probe_chunk_seconds}s chunk")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_label,
+            "model_name": self.model_name,
+            "device": "cpu",
+            "memory_bytes": self.model_memory_bytes,
+            "chunk_latency_seconds": self.chunk_latency_seconds,
+            "decode_options": sorted(GENERATE_OPTIONS) + ["word_timestamps"],
+        }
+
+    def reconfigure(self, config: Dict[str, Any]):
+        batching = config.get("batching", {})
+        self.transcribe_batch.set_max_batch_size(batching.get("max_batch_size", 8))
+        self.transcribe_batch.set_batch_wait_timeout_s(batching.get("batch_wait_timeout_s", 0.05))
+
+    async def transcribe(self, request: AudioRequest) -> Dict[str, Any]:
+        request.validate()
+        async with self.pending_audio(request.audio_seconds):
+            return await self.transcribe_batch(request)
+
+    @serve.batch(max_batch_size=8, batch_wait_timeout_s=0.05)
+    async def transcribe_batch(self, requests: List[AudioRequest]) -> List[Dict[str, Any]]:
+        audios = []
+        for request in requests:
+            audio = await request.get_audio()
+            if self.save_audio_debug:
+                await save_audio_to_file(float32_to_pcm(audio), request.file_name)
+            audios.append(self._speech_only(audio, request.sampling_rate, request.speech_segments))
+
+        results = await self.executor.run(self._transcribe_batch, [speech_audio for speech_audio, _ in audios],
+                                          [request.language for request in requests],
+                                          [request.decode_options for request in requests])
+        for result, (_, speech_map) in zip(results, audios):
+            self._restore_timestamps(result["words"], speech_map)
+        return results
+
+    def _transcribe_batch(self, audios: List[np.ndarray], languages: List[Optional[str]],
+                          decode_options: List[Optional[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        start = time.time()
+        # Codes like the detected languages, generate accepts names and codes
+        languages = [self._get_language_code(language) for language in languages]
+        probabilities = [1.0] * len(audios)
+        undetected = [i for i, language in enumerate(languages) if language is None]
+        if undetected:
+            detected = self._detect_languages([audios[i] for i in undetected])
+            for i, (language, probability) in zip(undetected, detected):
+                languages[i], probabilities[i] = language, probability
+
+        # Requests are batched with the others of the same language and decode options
+        groups: Dict[Tuple[str, bool, str], List[int]] = {}
+        generate_kwargs = {}
+        for i, (language, options) in enumerate(zip(languages, decode_options)):
+            word_timestamps = bool((options or {}).get("word_timestamps", True))
+            kwargs = self._generate_kwargs(options)
+            key = (language, word_timestamps, repr(sorted(kwargs.items())))
+            generate_kwargs[key] = kwargs
+            groups.setdefault(key, []).append(i)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(audios)
+        for key, indices in groups.items():
+            language, word_timestamps, _ = key
+            outputs = self.asr_pipeline(
+                [{"raw": audios[i], "sampling_rate": self.sampling_rate} for i in indices],
+                batch_size=len(indices),
+                chunk_length_s=self.chunk_length_s,
+                return_timestamps="word" if word_timestamps else None,
+                generate_kwargs={"language": language, "task": "transcribe", **generate_kwargs[key]},
+            )
+            for i, output in zip(indices, outputs):
+                results[i] = self._build_result(languages[i], probabilities[i], output)
+
+        get_metrics().observe_inference("asr_batch_inference", self.model_label, time.time() - start,
+                                        sum(len(audio) for audio in audios) / self.sampling_rate)
+        return results
+
+    def _generate_kwargs(self, decode_options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        generate() arguments of the decode options, greedy without any like the transformers default
+        """
+        kwargs = {"num_beams": 1}
+        for option, value in (decode_options or {}).items():
+            if option == "word_timestamps":
+                continue
+            if option not in GENERATE_OPTIONS:
+                if option not in self.ignored_options:
+                    logger.warning(f"WhisperASR {self.model_label} ignores the decode option {option}")
+                    self.ignored_options.add(option)
+                continue
+            # A list of temperatures is the fallback schedule, generate() takes it as a tuple
+            kwargs[GENERATE_OPTIONS[option]] = tuple(value) if isinstance(value, list) else value
+        return kwargs
+
+    def _detect_languages(self, audios: List[np.ndarray]) -> List[Tuple[str, float]]:
+        """
+        Most likely language token after the start of transcript token, from the first window of each audio
+        """
+        model = self.asr_pipeline.model
+        window = int(self.chunk_length_s * self.sampling_rate)
+        features = self.asr_pipeline.feature_extractor([audio[:window] for audio in audios],
+                                                       sampling_rate=self.sampling_rate,
+                                                       return_tensors="pt").input_features.to(model.dtype)
+        decoder_input_ids = torch.full((len(audios), 1), model.generation_config.decoder_start_token_id)
+        with torch.no_grad():
+            logits = model(input_features=features, decoder_input_ids=decoder_input_ids).logits[:, -1]
+
+        token_ids = list(self.language_tokens)
+        probabilities = torch.softmax(logits[:, token_ids], dim=-1)
+        best = probabilities.argmax(dim=-1)
+        return [(self.language_tokens[token_ids[index]], float(probabilities[row, index]))
+                for row, index in enumerate(best.tolist())]
+
+    @staticmethod
+    def _get_language_code(language: Optional[str]) -> Optional[str]:
+        if language is None:
+            return None
+        language = language.lower()
+        return language if language in TO_LANGUAGE_CODE.values() else TO_LANGUAGE_CODE.get(language, language)
+
+    @staticmethod
+    def _speech_only(audio: np.ndarray, sampling_rate: int, speech_segments: Optional[List[Dict[str, float]]]
+                     ) -> Tuple[np.ndarray, Optional[List[Tuple[float, float]]]]:
+        """
+        Concatenates the speech regions, returns the speech audio and the (speech start, audio start) seconds of
+        each region needed to map word timestamps back, or the audio unchanged when there are no regions
+        """
+        if not speech_segments:
+            return audio, None
+
+        speech = []
+        speech_map = []
+        speech_seconds = 0.0
+        for segment in speech_segments:
+            region = audio[int(segment["start"] * sampling_rate):int(segment["end"] * sampling_rate)]
+            if len(region) == 0:
+                continue
+            speech.append(region)
+            speech_map.append((speech_seconds, segment["start"]))
+            speech_seconds += len(region) / sampling_rate
+        if not speech:
+            return audio, None
+        return np.concatenate(speech), speech_map
+
+    @staticmethod
+    def _restore_timestamps(words: List[Dict[str, Any]], speech_map: Optional[List[Tuple[float, float]]]):
+        if speech_map is None:
+            return
+        speech_starts = [speech_start for speech_start, _ in speech_map]
+        for word in words:
+            # Both ends are mapped through the region the word's middle falls in
+            middle = (word["start"] + word["end"]) / 2
+            region = max(np.searchsorted(speech_starts, middle, side="right") - 1, 0)
+            shift = speech_map[region][1] - speech_map[region][0]
+            word["start"] += shift
+            word["end"] += shift
+
+    @staticmethod
+    def _build_result(language: str, language_probability: float, output: Dict[str, Any]
+                      ) -> Dict[str, Any]:
+        words = []
+        for chunk in output.get("chunks", []):
+            start, end = chunk["timestamp"]
+            # The last word of a chunk may have no end
+            words.append({"word": chunk["text"], "start": start, "end": end if end is not None else start,
+                          "probability": None})
+
+        return {
+            "language": language,
+            "language_probability": language_probability,
+            "text": output["text"].strip(),
+            "words": words,
         }
-        return result
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class AudioRingBuffer:
+    """
+    Fixed-capacity ring of 16-bit samples addressed by absolute session sample positions. Audio between
+    start and end is retained, releasing consumed audio only moves start. Views of the retained audio are
+    zero-copy NumPy slices of the ring, except the rare view that wraps around its end. With several channels
+    a position holds one frame, a row of one sample per channel, and views are (frames, channels) arrays.
+    """
+
+    def __init__(self, capacity_samples: int, channels: int = 1, position: int = 0):
+        if capacity_samples <= 0:
+            raise ValueError(f"Ring buffer capacity must be positive, got {capacity_samples}")
+        self.capacity = capacity_samples
+        self.channels = channels
+        self.samples = np.zeros(capacity_samples if channels == 1 else (capacity_samples, channels), dtype=np.int16)
+        # Empty, starting at position, when it replaces another ring of the same session
+        self.start = position
+        self.end = position
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    @property
+    def nbytes(self) -> int:
+        return self.samples.nbytes
+
+    def write(self, samples: np.ndarray) -> int:
+        """
+        Appends samples, returns how many of the oldest retained samples were released to make room
+        """
+        overflow = max(0, len(self) + len(samples) - self.capacity)
+        if len(samples) > self.capacity:
+            # Only the newest capacity samples can be kept, the positions still advance past the rest
+            self.end += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        self.start += overflow
+
+        position = self.end % self.capacity
+        first = min(len(samples), self.capacity - position)
+        self.samples[position:position + first] = samples[:first]
+        self.samples[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+        self.start = max(self.start, self.end - self.capacity)
+        return overflow
+
+    def view(self, start: int, end: int) -> np.ndarray:
+        if not self.start <= start <= end <= self.end:
+            raise ValueError(f"Samples [{start}, {end}) are outside the buffer [{self.start}, {self.end})")
+        first = start % self.capacity
+        last = first + end - start
+        if last <= self.capacity:
+            return self.samples[first:last]
+        return np.concatenate((self.samples[first:], self.samples[:last - self.capacity]))
+
+    def release(self, until: int):
+        """
+        Drops everything before the absolute position until
+        """
+        self.start = min(max(self.start, until), self.end)
+
+    def truncate(self, position: int):
+        """
+        Drops everything from the absolute position on
+        """
+        self.end = max(min(self.end, position), self.start)
+
+    def remove(self, position: int, num_samples: int):
+        """
+        Cuts num_samples out at position and moves the newer samples back over them. Unlike release this
+        copies, it is only meant for overload handling.
+        """
+        num_samples = min(num_samples, self.end - position)
+        if num_samples <= 0:
+            return
+        tail = self.view(position + num_samples, self.end).copy()
+        self.end = position
+        self.write(tail)
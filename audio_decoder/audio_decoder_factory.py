@@ -0,0 +1,18 @@
+from audio_decoder.audio_decoder_interface import AudioDecoderInterface
+from audio_decoder.audio_decoders import PCMDecoder, G711Decoder, ContainerDecoder
+
+
+class AudioDecoderFactory:
+
+    @staticmethod
+    def create_audio_decoder(codec: str, output_sampling_rate: int, channels: int = 1,
+                             **kwargs) -> AudioDecoderInterface:
+        if codec == "pcm_s16le":
+            return PCMDecoder(output_sampling_rate, channels, **kwargs)
+        elif codec in ("mulaw", "alaw"):
+            return G711Decoder(codec, output_sampling_rate, channels, **kwargs)
+        elif codec in ("opus_ogg", "opus_webm"):
+            return ContainerDecoder("ogg" if codec == "opus_ogg" else "webm", output_sampling_rate, channels,
+                                    **kwargs)
+        else:
+            raise ValueError(f"Unsupported input codec: {codec}")
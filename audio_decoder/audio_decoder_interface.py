@@ -0,0 +1,17 @@
+class AudioDecoderInterface:
+
+    def decode(self, data: bytes) -> bytes:
+        """
+        Decodes the next piece of the client's stream, returns the 16-bit PCM at the session sampling rate
+        that is ready so far, whole frames of interleaved samples when the session has several channels
+        """
+        raise NotImplementedError("This method should be implemented by sub class")
+
+    def flush(self) -> bytes:
+        """
+        Ends the stream, returns the PCM the decoder still holds. No data can be decoded afterwards.
+        """
+        return b""
+
+    def close(self):
+        pass
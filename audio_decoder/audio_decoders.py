@@ -0,0 +1,198 @@
+import io
+import logging
+import threading
+import time
+from typing import Optional
+
+import av
+import numpy as np
+
+from audio_decoder.audio_decoder_interface import AudioDecoderInterface
+from audio_utils import pcm_to_float32
+from metrics import get_metrics
+
+logger = logging.getLogger("ray.serve")
+
+
+def decode_audio_file(data: bytes, sampling_rate: int) -> np.ndarray:
+    """
+    Decodes a whole recording in any format FFmpeg reads to float32 mono audio at sampling_rate
+    """
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sampling_rate)
+    pcm = bytearray()
+    with av.open(io.BytesIO(data), mode="r", metadata_errors="ignore") as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                pcm += resampled.to_ndarray().tobytes()
+    for resampled in resampler.resample(None):
+        pcm += resampled.to_ndarray().tobytes()
+    return pcm_to_float32(bytes(pcm))
+
+
+class ResamplingDecoder(AudioDecoderInterface):
+    """
+    Base of the decoders, resamples decoded frames to 16-bit PCM with the session's channels at the session
+    rate and keeps the CPU time spent decoding so it can be reported per session
+    """
+
+    def __init__(self, codec: str, output_sampling_rate: int, channels: int = 1):
+        self.codec = codec
+        self.output_sampling_rate = output_sampling_rate
+        self.channels = channels
+        # Packed s16, the channels come out interleaved
+        self.layout = f"{channels}c"
+        self.resampler = av.AudioResampler(format="s16", layout=self.layout, rate=output_sampling_rate)
+        self.decode_seconds = 0.0
+
+    def resample(self, frame: Optional[av.AudioFrame]) -> bytes:
+        return b"".join(resampled.to_ndarray().tobytes() for resampled in self.resampler.resample(frame))
+
+    def track(self, start: float):
+        seconds = time.thread_time() - start
+        self.decode_seconds += seconds
+        get_metrics().decode_seconds.inc(seconds, tags={"codec": self.codec})
+
+    def flush(self) -> bytes:
+        # The resampler holds back the samples its filter still needs
+        start = time.thread_time()
+        pcm = self.resample(None)
+        self.track(start)
+        return pcm
+
+
+class PCMDecoder(ResamplingDecoder):
+    """
+    Raw 16-bit little-endian PCM, channels interleaved, only resampled when the client sends another rate
+    """
+
+    def __init__(self, output_sampling_rate: int, channels: int = 1, **kwargs):
+        super().__init__("pcm_s16le", output_sampling_rate, channels)
+        self.sampling_rate = int(kwargs.get("sampling_rate", output_sampling_rate))
+        # A trailing partial frame is kept for the next message
+        self.remainder = b""
+
+    def decode(self, data: bytes) -> bytes:
+        data = self.remainder + data
+        usable = len(data) - len(data) % (2 * self.channels)
+        self.remainder = data[usable:]
+        if self.sampling_rate == self.output_sampling_rate:
+            return data[:usable]
+
+        start = time.thread_time()
+        frame = av.AudioFrame.from_ndarray(np.frombuffer(data[:usable], dtype=np.int16)[None, :],
+                                           format="s16", layout=self.layout)
+        frame.sample_rate = self.sampling_rate
+        pcm = self.resample(frame)
+        self.track(start)
+        return pcm
+
+
+class G711Decoder(ResamplingDecoder):
+    """
+    Headerless telephony μ-law or A-law, one byte per sample, 8 kHz unless sampling_rate says otherwise
+    """
+
+    def __init__(self, law: str, output_sampling_rate: int, channels: int = 1, **kwargs):
+        super().__init__(law, output_sampling_rate, channels)
+        self.codec_context = av.CodecContext.create("pcm_mulaw" if law == "mulaw" else "pcm_alaw", "r")
+        self.codec_context.sample_rate = int(kwargs.get("sampling_rate", 8000))
+        self.codec_context.layout = self.layout
+
+    def decode(self, data: bytes) -> bytes:
+        start = time.thread_time()
+        pcm = b"".join(self.resample(frame) for frame in self.codec_context.decode(av.Packet(data)))
+        self.track(start)
+        return pcm
+
+
+class StreamBuffer:
+    """
+    File-like object fed from the websocket, reads block until enough data arrived or the stream was closed,
+    which lets the demuxer run incrementally on a stream that never seeks
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, data: bytes):
+        with self.condition:
+            self.data += data
+            self.condition.notify()
+
+    def read(self, size: int = -1) -> bytes:
+        with self.condition:
+            while not self.data and not self.closed:
+                self.condition.wait()
+            size = len(self.data) if size < 0 else min(size, len(self.data))
+            chunk = bytes(self.data[:size])
+            del self.data[:size]
+            return chunk
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class ContainerDecoder(ResamplingDecoder):
+    """
+    Opus, or anything else FFmpeg decodes, in an Ogg or WebM stream as sent by browser MediaRecorder. The
+    demuxer runs on its own thread reading from a StreamBuffer, decode() hands it the new bytes and returns
+    the PCM decoded since the previous call. flush() waits up to flush_timeout_seconds for the demuxer to
+    decode the rest of the stream.
+    """
+
+    def __init__(self, container_format: str, output_sampling_rate: int, channels: int = 1, **kwargs):
+        super().__init__(f"opus_{container_format}", output_sampling_rate, channels)
+        self.container_format = container_format
+        # Small probe so the first audio comes out after the first pages instead of after a second of stream
+        self.probe_size = str(kwargs.get("probe_size", 4096))
+        self.flush_timeout_seconds = float(kwargs.get("flush_timeout_seconds", 1.0))
+
+        self.stream = StreamBuffer()
+        self.output = bytearray()
+        self.output_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.demux, name=f"ContainerDecoder-{container_format}", daemon=True)
+        self.thread.start()
+
+    def demux(self):
+        try:
+            with av.open(self.stream, mode="r", format=self.container_format,
+                         options={"probesize": self.probe_size, "analyzeduration": "0"}) as container:
+                start = time.thread_time()
+                for frame in container.decode(audio=0):
+                    pcm = self.resample(frame)
+                    with self.output_lock:
+                        self.output += pcm
+                    self.track(start)
+                    start = time.thread_time()
+                # End of stream, the codec was drained by decode, the resampler still holds its last samples
+                pcm = self.resample(None)
+                with self.output_lock:
+                    self.output += pcm
+                self.track(start)
+        except Exception:
+            if not self.stream.closed:
+                logger.exception(f"Failed decoding {self.codec} stream")
+
+    def decode(self, data: bytes) -> bytes:
+        self.stream.write(data)
+        with self.output_lock:
+            pcm = bytes(self.output)
+            self.output.clear()
+        return pcm
+
+    def flush(self) -> bytes:
+        self.stream.close()
+        self.thread.join(self.flush_timeout_seconds)
+        if self.thread.is_alive():
+            logger.warning(f"Timed out flushing {self.codec} stream")
+        with self.output_lock:
+            pcm = bytes(self.output)
+            self.output.clear()
+        return pcm
+
+    def close(self):
+        self.stream.close()
@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import ray
+
+from audio_utils import pcm_to_float32
+
+AUDIO_REQUEST_VERSION = 1
+
+# Ray inlines task arguments below 100KiB, anything larger is worth putting in the object store once
+DEFAULT_OBJECT_STORE_THRESHOLD_BYTES = 100 * 1024
+
+
+@dataclass
+class AudioRequest:
+    client_id: str
+    file_name: str
+    audio: Union[np.ndarray, ray.ObjectRef]
+    sampling_rate: int
+    language: Optional[str] = None
+    # Speech regions of the audio in seconds, when set the ASR decodes only these
+    speech_segments: Optional[List[Dict[str, float]]] = None
+    # faster-whisper decode options resolved from the session's decode profile, the library defaults when None
+    decode_options: Optional[Dict[str, Any]] = None
+    # Length of the audio, known without fetching it from the object store
+    num_samples: Optional[int] = None
+    version: int = AUDIO_REQUEST_VERSION
+
+    @classmethod
+    def from_client(cls, client, object_store_threshold_bytes: int = DEFAULT_OBJECT_STORE_THRESHOLD_BYTES):
+        return cls.from_pcm(client, client.scratch_audio(), object_store_threshold_bytes)
+
+    @classmethod
+    def from_pcm(cls, client, pcm: Union[bytes, np.ndarray], object_store_threshold_bytes: int = DEFAULT_OBJECT_STORE_THRESHOLD_BYTES):
+        return cls.from_audio(client, pcm_to_float32(pcm, client.sampling_width), object_store_threshold_bytes)
+
+    @classmethod
+    def from_audio(cls, client, audio: np.ndarray,
+                   object_store_threshold_bytes: int = DEFAULT_OBJECT_STORE_THRESHOLD_BYTES,
+                   channel: Optional[int] = None):
+        """
+        Request for the audio of the client, or of one channel of a multi-channel client
+        """
+        num_samples = len(audio)
+        if audio.nbytes > object_store_threshold_bytes:
+            audio = ray.put(audio)
+
+        return cls(
+            client_id=client.client_id,
+            file_name=client.get_file_name(channel),
+            audio=audio,
+            sampling_rate=client.sampling_rate,
+            language=client.request_language(channel),
+            decode_options=client.decode_options,
+            num_samples=num_samples,
+        )
+
+    def __post_init__(self):
+        if self.num_samples is None and isinstance(self.audio, np.ndarray):
+            self.num_samples = len(self.audio)
+
+    @property
+    def audio_seconds(self) -> float:
+        """
+        Seconds of audio the ASR decodes, only the speech regions when they are set
+        """
+        if self.speech_segments:
+            return sum(max(0.0, segment["end"] - segment["start"]) for segment in self.speech_segments)
+        return (self.num_samples or 0) / self.sampling_rate
+
+    def validate(self):
+        if self.version != AUDIO_REQUEST_VERSION:
+            raise ValueError(f"Unsupported audio request version: {self.version}")
+
+    async def get_audio(self) -> np.ndarray:
+        if isinstance(self.audio, ray.ObjectRef):
+            return await self.audio
+        return self.audio
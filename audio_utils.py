@@ -1,6 +1,27 @@
 import wave
 import os
 
+import numpy as np
+from typing import Union
+
+
+def pcm_to_float32(audio_data: Union[bytes, np.ndarray], sampling_width: int = 2) -> np.ndarray:
+    if sampling_width != 2:
+        raise ValueError(f"Unsupported sampling width: {sampling_width}")
+    return np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def float32_to_pcm(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+
+def warmup_audio(seconds: float, sampling_rate: int = 16000) -> np.ndarray:
+    """
+    Tone over noise, for warming models up without shipping a recording
+    """
+    t = np.arange(int(seconds * sampling_rate)) / sampling_rate
+    return (0.1 * np.sin(2 * np.pi * 220 * t) + 0.01 * np.random.randn(len(t))).astype(np.float32)
+
 
 async def save_audio_to_file(audio_data: bytes, filename: str, audio_dir: str = "audio_file",
                              audio_format: str = "wave") -> str:
@@ -0,0 +1,325 @@
+"""
+Load benchmark - opens many concurrent websocket sessions against the transcription service, streams synthetic
+or recorded PCM at a configurable pace and reports latency percentiles, throughput and error rates as JSON.
+
+Run with --stub to start the service locally with the stand-in VAD/ASR deployments, which benchmarks the
+ingress, buffering and Ray plumbing without any model downloads. --local-asr faster_whisper or whisper starts it
+with that ASR backend and the energy VAD instead, to compare the backends under identical load.
+
+With --decode-profiles the benchmark runs once per profile and reports each, with --reference holding the
+transcript of --audio-file the reports include the word error rate of every session's transcript.
+--channels streams the audio as a multi-channel call with the same audio on every channel.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import websockets
+
+SAMPLING_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+@dataclass
+class SessionStats:
+    connected: bool = False
+    rejected: bool = False
+    error: Optional[str] = None
+    audio_seconds_sent: float = 0.0
+    results: int = 0
+    # Wall time between sending the last byte of a transcribed chunk and receiving its result
+    latencies: List[float] = field(default_factory=list)
+    processing_times: List[float] = field(default_factory=list)
+    slow_down: int = 0
+    # Chunks refused by the reject policy, drop_oldest drops silently and only shows up in the server metrics
+    dropped_chunks: int = 0
+    # Text of the transcription and final results, in order
+    texts: List[str] = field(default_factory=list)
+
+
+def synthetic_audio(seconds: float, speech_seconds: float = 2.5, pause_seconds: float = 0.8) -> bytes:
+    """
+    Bursts of amplitude-modulated harmonics separated by near-silence, loud enough to trip the energy VAD
+    """
+    t = np.arange(int(seconds * SAMPLING_RATE)) / SAMPLING_RATE
+    voice = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 540, 720)))
+    voice *= 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    speech = (t % (speech_seconds + pause_seconds)) < speech_seconds
+    audio = np.where(speech, 0.3 * voice, 0.001 * np.random.randn(len(t)))
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def load_audio(audio_file_path: str) -> bytes:
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(audio_file_path)
+    return audio.set_frame_rate(SAMPLING_RATE).set_channels(1).set_sample_width(SAMPLE_WIDTH).raw_data
+
+
+def normalize_words(text: str) -> List[str]:
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    Word level edit distance between the transcripts divided by the reference length
+    """
+    reference_words = normalize_words(reference)
+    hypothesis_words = normalize_words(hypothesis)
+    distances = list(range(len(hypothesis_words) + 1))
+    for i, reference_word in enumerate(reference_words, 1):
+        previous_diagonal, distances[0] = distances[0], i
+        for j, hypothesis_word in enumerate(hypothesis_words, 1):
+            substitution = previous_diagonal + (reference_word != hypothesis_word)
+            previous_diagonal = distances[j]
+            distances[j] = min(distances[j] + 1, distances[j - 1] + 1, substitution)
+    return distances[-1] / max(len(reference_words), 1)
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None, "mean": None}
+    array = np.asarray(values)
+    return {
+        "count": len(values),
+        "p50": float(np.percentile(array, 50)),
+        "p90": float(np.percentile(array, 90)),
+        "p99": float(np.percentile(array, 99)),
+        "max": float(array.max()),
+        "mean": float(array.mean()),
+    }
+
+
+async def run_session(uri: str, audio: bytes, args, stats: SessionStats, decode_profile: Optional[str] = None):
+    frame_bytes = SAMPLE_WIDTH * args.channels
+    chunk_bytes = int(args.chunk_seconds * SAMPLING_RATE) * frame_bytes
+    # session seconds -> wall time at which that much audio had been sent
+    sent_marks: List[tuple] = []
+    done_sending = asyncio.Event()
+
+    def sent_at(audio_end: float) -> Optional[float]:
+        for seconds, timestamp in sent_marks:
+            if seconds >= audio_end - 1e-6:
+                return timestamp
+        return None
+
+    try:
+        async with websockets.connect(uri, ping_interval=20, ping_timeout=60, close_timeout=10,
+                                      max_size=None) as websocket:
+            stats.connected = True
+            await websocket.send(json.dumps({
+                "type": "config",
+                "data": {
+                    "language": args.language,
+                    "channels": args.channels,
+                    "decode_profile": decode_profile,
+                    "processing_strategy": args.strategy,
+                    "processing_args": json.loads(args.strategy_args),
+                },
+            }))
+
+            async def send_audio():
+                burst_remaining = 0
+                for i in range(0, len(audio), chunk_bytes):
+                    chunk = audio[i:i + chunk_bytes]
+                    await websocket.send(chunk)
+                    stats.audio_seconds_sent += len(chunk) / (SAMPLING_RATE * frame_bytes)
+                    sent_marks.append((stats.audio_seconds_sent, time.time()))
+
+                    chunk_seconds = len(chunk) / (SAMPLING_RATE * frame_bytes)
+                    if args.pacing == "realtime":
+                        await asyncio.sleep(chunk_seconds)
+                    elif args.pacing == "fast":
+                        await asyncio.sleep(chunk_seconds / args.speedup)
+                    elif args.pacing == "bursty":
+                        # Send bursts back to back, then catch up on the wall clock so the average stays real-time
+                        if burst_remaining <= 0:
+                            burst_remaining = random.randint(1, args.burst_chunks)
+                            await asyncio.sleep(chunk_seconds * burst_remaining)
+                        burst_remaining -= 1
+                await websocket.send(json.dumps({"type": "end_of_stream"}))
+                done_sending.set()
+
+            async def receive_results():
+                while True:
+                    timeout = args.drain_seconds if done_sending.is_set() else None
+                    try:
+                        message = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        if done_sending.is_set():
+                            return
+                        continue
+                    received_at = time.time()
+                    result = json.loads(message)
+
+                    if result.get("type") == "slow_down":
+                        stats.slow_down += 1
+                        continue
+                    if result.get("type") == "status":
+                        if result.get("reason") == "buffer_full":
+                            stats.dropped_chunks += 1
+                        elif result.get("status") == "rejected":
+                            stats.rejected = True
+                        continue
+
+                    stats.results += 1
+                    # Every channel carries the same audio, the transcript is the first channel's
+                    if result.get("type") != "partial" and result.get("text") and result.get("channel", 0) == 0:
+                        stats.texts.append(result["text"])
+                    if "processing_time" in result:
+                        stats.processing_times.append(result["processing_time"])
+                    if "audio_end" in result:
+                        sent = sent_at(result["audio_end"])
+                        if sent is not None:
+                            stats.latencies.append(received_at - sent)
+
+            receiver = asyncio.create_task(receive_results())
+            sender = asyncio.create_task(send_audio())
+            done, _ = await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await sender
+            await receiver
+    except websockets.ConnectionClosed as e:
+        if e.rcvd is not None and e.rcvd.code == 1013:
+            stats.rejected = True
+        else:
+            stats.error = f"connection closed: {e}"
+    except Exception as e:
+        stats.error = f"{type(e).__name__}: {e}"
+
+
+async def run_benchmark(args, audio: bytes, decode_profile: Optional[str] = None,
+                        reference: Optional[str] = None) -> Dict[str, Any]:
+    sessions = [SessionStats() for _ in range(args.clients)]
+
+    async def start_session(i: int):
+        if args.ramp_seconds > 0:
+            await asyncio.sleep(args.ramp_seconds * i / args.clients)
+        await run_session(args.uri, audio, args, sessions[i], decode_profile)
+
+    start = time.time()
+    await asyncio.gather(*(start_session(i) for i in range(args.clients)))
+    wall_seconds = time.time() - start
+
+    audio_seconds = sum(s.audio_seconds_sent for s in sessions)
+    word_error_rates = [word_error_rate(reference, " ".join(s.texts)) for s in sessions
+                        if reference is not None and s.connected and s.error is None]
+    return {
+        "config": {
+            "clients": args.clients,
+            "pacing": args.pacing,
+            "chunk_seconds": args.chunk_seconds,
+            "strategy": args.strategy,
+            "decode_profile": decode_profile,
+            "channels": args.channels,
+            "audio_seconds_per_client": len(audio) / (SAMPLING_RATE * SAMPLE_WIDTH * args.channels),
+        },
+        "wall_seconds": wall_seconds,
+        "audio_seconds_sent": audio_seconds,
+        "throughput_audio_seconds_per_second": audio_seconds / wall_seconds if wall_seconds > 0 else 0.0,
+        "results": sum(s.results for s in sessions),
+        "end_to_end_latency": percentiles([latency for s in sessions for latency in s.latencies]),
+        "processing_time": percentiles([t for s in sessions for t in s.processing_times]),
+        "word_error_rate": percentiles(word_error_rates),
+        "sessions": {
+            "connected": sum(s.connected and not s.rejected for s in sessions),
+            "rejected": sum(s.rejected for s in sessions),
+            "errors": sum(s.error is not None for s in sessions),
+            "error_rate": sum(s.error is not None for s in sessions) / len(sessions),
+        },
+        "backpressure": {
+            "slow_down_messages": sum(s.slow_down for s in sessions),
+            "dropped_chunks": sum(s.dropped_chunks for s in sessions),
+            "drop_rate": (sum(s.dropped_chunks for s in sessions) * args.chunk_seconds / audio_seconds
+                          if audio_seconds else 0.0),
+        },
+        "error_samples": sorted({s.error for s in sessions if s.error is not None})[:5],
+    }
+
+
+def start_local_service(args):
+    import ray
+    from ray import serve
+
+    from server import build_app
+
+    if args.stub:
+        app_args = {
+            "asr_type": "stub",
+            "vad_type": "stub",
+            "asr_args": {"latency_seconds": args.stub_asr_latency, "jitter_seconds": args.stub_asr_jitter},
+            "vad_args": {"latency_seconds": args.stub_vad_latency},
+        }
+    else:
+        app_args = {"asr_type": args.local_asr, "vad_type": "energy", "asr_args": json.loads(args.local_asr_args)}
+
+    ray.init()
+    serve.run(build_app(app_args), name="transcription-service", route_prefix="/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="ws://localhost:8000/")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--audio-file", help="Recorded audio to stream, synthetic audio is used when omitted")
+    parser.add_argument("--audio-seconds", type=float, default=30.0, help="Length of the synthetic audio")
+    parser.add_argument("--chunk-seconds", type=float, default=0.25)
+    parser.add_argument("--pacing", choices=["realtime", "fast", "bursty"], default="realtime")
+    parser.add_argument("--speedup", type=float, default=4.0, help="Send rate multiplier for --pacing fast")
+    parser.add_argument("--burst-chunks", type=int, default=8, help="Largest burst for --pacing bursty")
+    parser.add_argument("--ramp-seconds", type=float, default=0.0, help="Spread client connects over this time")
+    parser.add_argument("--drain-seconds", type=float, default=10.0,
+                        help="How long to wait for results after the last chunk")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--channels", type=int, default=1, help="Channels of the streamed audio")
+    parser.add_argument("--decode-profiles",
+                        help="Comma separated decode profiles to benchmark one after the other, e.g. fast,accurate")
+    parser.add_argument("--reference", help="Text file with the transcript of --audio-file, for the word error rate")
+    parser.add_argument("--strategy", default="silence_at_the_end_of_chunk")
+    parser.add_argument("--strategy-args", default='{"chunk_length_seconds": 3, "chunk_offset_seconds": 0.1}')
+    parser.add_argument("--stub", action="store_true", help="Start the service with the stub VAD/ASR deployments")
+    parser.add_argument("--stub-asr-latency", type=float, default=0.2)
+    parser.add_argument("--stub-asr-jitter", type=float, default=0.0)
+    parser.add_argument("--stub-vad-latency", type=float, default=0.01)
+    parser.add_argument("--local-asr", choices=["faster_whisper", "whisper"],
+                        help="Start the service with this ASR backend and the energy VAD")
+    parser.add_argument("--local-asr-args", default="{}", help="JSON constructor arguments of the --local-asr backend")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    if args.stub or args.local_asr:
+        start_local_service(args)
+
+    audio = load_audio(args.audio_file) if args.audio_file else synthetic_audio(args.audio_seconds)
+    if args.channels > 1:
+        audio = np.repeat(np.frombuffer(audio, dtype=np.int16), args.channels).tobytes()
+    reference = None
+    if args.reference:
+        with open(args.reference) as f:
+            reference = f.read()
+
+    if args.decode_profiles:
+        report = {"profiles": {
+            profile: asyncio.run(run_benchmark(args, audio, profile, reference))
+            for profile in args.decode_profiles.split(",")
+        }}
+    else:
+        report = asyncio.run(run_benchmark(args, audio, reference=reference))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
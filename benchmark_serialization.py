@@ -0,0 +1,76 @@
+"""
+Serialization benchmark - compares the payload shipped to the VAD/ASR deployments per chunk
+when pickling the whole Client against the compact AudioRequest.
+"""
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import ray
+from ray import cloudpickle
+
+from audio_buffer import AudioRingBuffer
+from audio_request import AudioRequest
+from client import Client
+
+
+def measure(fn, iterations):
+    payload = None
+    start = time.perf_counter()
+    for _ in range(iterations):
+        payload = fn()
+    elapsed = (time.perf_counter() - start) / iterations
+    return {"bytes": len(payload), "seconds": elapsed}
+
+
+class BytearrayClientPickler(cloudpickle.CloudPickler):
+    """
+    Pickles a client as it was shipped before the ring buffer, with its retained audio in a bytearray sized
+    to the audio instead of the preallocated ring
+    """
+
+    def reducer_override(self, obj):
+        if isinstance(obj, AudioRingBuffer):
+            return bytearray, (obj.view(obj.start, obj.end).tobytes(),)
+        return super().reducer_override(obj)
+
+
+def dumps_bytearray_client(client: Client) -> bytes:
+    file = io.BytesIO()
+    BytearrayClientPickler(file).dump(client)
+    return file.getvalue()
+
+
+def benchmark(chunk_seconds: float, iterations: int):
+    client = Client("benchmark", 16000, 2)
+    # The PyAV decoder cannot be pickled and was never part of what got shipped
+    client.decoder = None
+    samples = np.random.randint(-32768, 32767, int(chunk_seconds * 16000), dtype=np.int16)
+    client.write(samples)
+    client.extend_scratch(client.take_pending())
+    client.write(samples)
+
+    results = {
+        "chunk_seconds": chunk_seconds,
+        # Before: the client was pickled once for VAD and once for ASR
+        "client": measure(lambda: dumps_bytearray_client(client), iterations),
+        "audio_request_inline": measure(
+            lambda: cloudpickle.dumps(AudioRequest.from_client(client, object_store_threshold_bytes=2 ** 62)),
+            iterations),
+        "audio_request_object_store": measure(
+            lambda: cloudpickle.dumps(AudioRequest.from_client(client, object_store_threshold_bytes=0)),
+            iterations),
+    }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-seconds", type=float, nargs="+", default=[3, 10, 30])
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    ray.init(num_cpus=1, include_dashboard=False)
+    print(json.dumps([benchmark(s, args.iterations) for s in args.chunk_seconds], indent=2))
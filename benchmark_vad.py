@@ -0,0 +1,83 @@
+"""
+VAD benchmark - runs the pyannote and energy VAD backends over the same audio, chunk by chunk,
+and reports their speed and how often they agree.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+from pydub import AudioSegment
+
+from audio_request import AudioRequest
+from vad.energy_vad import EnergyVAD
+from vad.pyannote_vad import PyannoteVAD
+
+
+def segments_to_frames(segments, num_frames, frame_seconds):
+    frames = np.zeros(num_frames, dtype=bool)
+    for segment in segments:
+        frames[int(segment["start"] / frame_seconds):int(np.ceil(segment["end"] / frame_seconds))] = True
+    return frames
+
+
+async def run_vad(vad, chunks, sampling_rate):
+    results = []
+    start = time.perf_counter()
+    for i, chunk in enumerate(chunks):
+        request = AudioRequest(client_id="benchmark", file_name=f"benchmark_{i}.wav", audio=chunk,
+                               sampling_rate=sampling_rate)
+        results.append(await vad.detect_activity(request))
+    return results, time.perf_counter() - start
+
+
+async def benchmark(audio_file_path: str, chunk_seconds: float, frame_seconds: float):
+    audio = AudioSegment.from_file(audio_file_path).set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    sampling_rate = 16000
+    waveform = np.frombuffer(audio.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+
+    chunk_length = int(chunk_seconds * sampling_rate)
+    chunks = [waveform[i:i + chunk_length] for i in range(0, len(waveform), chunk_length)]
+    duration = len(waveform) / sampling_rate
+
+    # Instantiate the deployment classes directly so the benchmark runs in-process
+    pyannote_results, pyannote_seconds = await run_vad(PyannoteVAD.func_or_class(), chunks, sampling_rate)
+    energy_results, energy_seconds = await run_vad(EnergyVAD.func_or_class(), chunks, sampling_rate)
+
+    true_positive = false_positive = false_negative = total_frames = 0
+    chunk_agreement = 0
+    for chunk, reference, hypothesis in zip(chunks, pyannote_results, energy_results):
+        num_frames = int(len(chunk) / sampling_rate / frame_seconds)
+        reference_frames = segments_to_frames(reference, num_frames, frame_seconds)
+        hypothesis_frames = segments_to_frames(hypothesis, num_frames, frame_seconds)
+        true_positive += int(np.sum(reference_frames & hypothesis_frames))
+        false_positive += int(np.sum(~reference_frames & hypothesis_frames))
+        false_negative += int(np.sum(reference_frames & ~hypothesis_frames))
+        total_frames += num_frames
+        chunk_agreement += int((len(reference) > 0) == (len(hypothesis) > 0))
+
+    return {
+        "audio_seconds": duration,
+        "chunks": len(chunks),
+        "pyannote": {"seconds": pyannote_seconds, "real_time_factor": pyannote_seconds / duration},
+        "energy": {"seconds": energy_seconds, "real_time_factor": energy_seconds / duration},
+        "speedup": pyannote_seconds / energy_seconds if energy_seconds > 0 else None,
+        "agreement": {
+            "frame_accuracy": 1 - (false_positive + false_negative) / max(total_frames, 1),
+            "frame_precision": true_positive / max(true_positive + false_positive, 1),
+            "frame_recall": true_positive / max(true_positive + false_negative, 1),
+            # Whether both backends agree that a chunk has speech, the decision that saves the remote call
+            "chunk_speech_agreement": chunk_agreement / max(len(chunks), 1),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("audio_file")
+    parser.add_argument("--chunk-seconds", type=float, default=3.0)
+    parser.add_argument("--frame-seconds", type=float, default=0.02)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(benchmark(args.audio_file, args.chunk_seconds, args.frame_seconds)), indent=2))
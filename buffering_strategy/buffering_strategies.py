@@ -2,12 +2,21 @@ import asyncio
 import os
 import time
 import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
 
+import numpy as np
 from fastapi import WebSocket
-from ray.serve.handle import DeploymentHandle
+from ray.serve.handle import DeploymentHandle, DeploymentResponse
 
 from asr.asr_interface import ASRInterface
+from audio_request import AudioRequest, DEFAULT_OBJECT_STORE_THRESHOLD_BYTES
+from audio_utils import pcm_to_float32
 from buffering_strategy.buffering_strategy_interface import BufferingStrategyInterface
+from metrics import get_metrics
+from serve_utils import parse_flag
+from vad.energy_vad import EnergyVADPipeline
+from vad.streaming_vad import StreamingVAD
 
 import logging
 
@@ -18,10 +27,40 @@ logger = logging.getLogger("ray.serve")
 logger.setLevel(logging.DEBUG)
 
 
+def create_inline_vad(**kwargs) -> Optional[EnergyVADPipeline]:
+    """
+    Energy VAD run on the ingress so chunks without any speech never reach the VAD deployment, None when the
+    inline_vad argument or BUFFERING_INLINE_VAD is off
+    """
+    inline_vad = os.environ.get("BUFFERING_INLINE_VAD")
+    if not inline_vad:
+        inline_vad = kwargs.get("inline_vad", False)
+    if not parse_flag(inline_vad):
+        return None
+    return EnergyVADPipeline(**kwargs.get("inline_vad_args", {}))
+
+
+@dataclass
+class PendingTranscription:
+    response: DeploymentResponse
+    start: float
+    submitted_at: float
+    audio_seconds: float
+    # Absolute session time of the end of the transcribed audio
+    audio_end: float
+    # Language sent with the request, None when the ASR detected it
+    language: Optional[str]
+    # Channel of each result of a multi-channel request, None when the response is a single result
+    channels: Optional[List[int]] = None
+    # Language sent for each channel of a multi-channel request, every channel has its own language lock
+    channel_languages: Optional[List[Optional[str]]] = None
+
+
 class SilenceAtEndOfChunk(BufferingStrategyInterface):
 
     def __init__(self, client, **kwargs):
         self.client = client
+        self.strategy_name = client.config["processing_strategy"]
 
         self.chunk_length_seconds = os.environ.get("BUFFERING_CHUNK_LENGTH_SECONDS")
         if not self.chunk_length_seconds:
@@ -36,49 +75,571 @@ class SilenceAtEndOfChunk(BufferingStrategyInterface):
         self.error_if_not_realtime = os.environ.get("ERROR_IF_NOT_REALTIME")
         if not self.error_if_not_realtime:
             self.error_if_not_realtime = kwargs.get("error_if_not_realtime", False)
+        self.error_if_not_realtime = parse_flag(self.error_if_not_realtime)
 
-        self.processing_flag = False
+        self.object_store_threshold_bytes = os.environ.get("OBJECT_STORE_THRESHOLD_BYTES")
+        if not self.object_store_threshold_bytes:
+            self.object_store_threshold_bytes = kwargs.get("object_store_threshold_bytes",
+                                                           DEFAULT_OBJECT_STORE_THRESHOLD_BYTES)
+        self.object_store_threshold_bytes = int(self.object_store_threshold_bytes)
+
+        self.vad_mode = os.environ.get("BUFFERING_VAD_MODE")
+        if not self.vad_mode:
+            self.vad_mode = kwargs.get("vad_mode", "full")
+
+        self.vad_context_seconds = os.environ.get("BUFFERING_VAD_CONTEXT_SECONDS")
+        if not self.vad_context_seconds:
+            self.vad_context_seconds = kwargs.get("vad_context_seconds", 1.0)
+        self.vad_context_seconds = float(self.vad_context_seconds)
+
+        if self.vad_mode == "incremental":
+            # One per channel
+            self.streaming_vads = [StreamingVAD(self.client.sampling_rate, self.vad_context_seconds)
+                                   for _ in range(self.client.channels)]
+        elif self.vad_mode == "full":
+            self.streaming_vads = None
+        else:
+            raise ValueError(f"Unsupported vad mode: {self.vad_mode}")
+
+        self.inline_vad_pipeline = create_inline_vad(**kwargs)
+
+        self.asr_speech_only = os.environ.get("BUFFERING_ASR_SPEECH_ONLY")
+        if not self.asr_speech_only:
+            self.asr_speech_only = kwargs.get("asr_speech_only", True)
+        self.asr_speech_only = parse_flag(self.asr_speech_only)
+
+        # Kept around every VAD segment handed to the ASR so word onsets and endings are not clipped
+        self.speech_pad_seconds = os.environ.get("BUFFERING_SPEECH_PAD_SECONDS")
+        if not self.speech_pad_seconds:
+            self.speech_pad_seconds = kwargs.get("speech_pad_seconds", 0.2)
+        self.speech_pad_seconds = float(self.speech_pad_seconds)
+
+        # Longest scratch buffer before a cut is forced, so an utterance without a pause never outgrows the
+        # ring buffer. The rest of the ring holds the queued chunks and the audio still arriving.
+        ring_buffer_seconds = self.client.admission_controller.ring_buffer_seconds
+        self.max_scratch_seconds = os.environ.get("BUFFERING_MAX_SCRATCH_SECONDS")
+        if not self.max_scratch_seconds:
+            self.max_scratch_seconds = kwargs.get("max_scratch_seconds", ring_buffer_seconds / 2)
+        self.max_scratch_seconds = float(self.max_scratch_seconds)
+        if self.max_scratch_seconds >= ring_buffer_seconds:
+            raise ValueError(f"max_scratch_seconds of {self.max_scratch_seconds}s must be shorter than the "
+                             f"{ring_buffer_seconds}s ring buffer")
+
+        self.pipeline_depth = os.environ.get("BUFFERING_PIPELINE_DEPTH")
+        if not self.pipeline_depth:
+            self.pipeline_depth = kwargs.get("pipeline_depth", 2)
+        self.pipeline_depth = int(self.pipeline_depth)
+
+        # An end of stream not queued yet because the pipeline was full
+        self.end_of_stream = False
+        # Chunks waiting for VAD, and transcriptions in flight waiting to be sent, in arrival order
+        self.chunk_queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        self.result_queue = asyncio.Queue(maxsize=self.pipeline_depth)
+        self.pipeline_tasks = []
 
     def process_audio(self, web_socket: WebSocket, vad_handle: DeploymentHandle, asr_handle: DeploymentHandle):
-        chunk_length_in_bytes = self.chunk_length_seconds * self.client.sampling_rate * self.client.sampling_width
+        chunk_length_in_samples = self.chunk_length_seconds * self.client.sampling_rate
+        self.end_of_stream = self.client.take_end_of_stream() or self.end_of_stream
+
+        if self.client.pending_samples > chunk_length_in_samples or self.end_of_stream:
+            if self.chunk_queue.full():
+                logger.warning("Tried queueing a new chunk while the session pipeline is full")
+                get_metrics().chunks.inc(tags={"outcome": "queue_full", "strategy": self.strategy_name})
+                return
+
+            self.queue_chunk()
+            if not self.pipeline_tasks:
+                self.pipeline_tasks = [
+                    asyncio.create_task(self.vad_stage(vad_handle, asr_handle)),
+                    asyncio.create_task(self.send_stage(web_socket)),
+                ]
+
+    def queue_chunk(self):
+        get_metrics().session_buffer_bytes.observe(self.client.buffered_bytes, tags={"strategy": self.strategy_name})
+        # Only the chunk's end position is queued, its audio stays in the client's ring buffer. The last
+        # chunk of a stream is transcribed whatever its length and wherever the speech in it ends.
+        self.chunk_queue.put_nowait((self.client.take_pending(), time.time(), self.end_of_stream))
+        self.end_of_stream = False
+
+    def close(self):
+        for task in self.pipeline_tasks:
+            task.cancel()
+        self.pipeline_tasks = []
+
+        while not self.result_queue.empty():
+            pending = self.result_queue.get_nowait()
+            self.client.admission_controller.asr_finished(pending.audio_seconds)
+
+    async def vad_stage(self, vad_handle: DeploymentHandle, asr_handle: DeploymentHandle):
+        """
+        Runs VAD on queued chunks in order and starts ASR on completed utterances without waiting for it,
+        so VAD on the next chunk overlaps with ASR on the previous one
+        """
+        while True:
+            chunk_end, queued_at, final = await self.chunk_queue.get()
+            if self.end_of_stream:
+                # The end of stream arrived while the pipeline was full, no more audio will trigger
+                # process_audio so its tail is queued in the slot just freed
+                self.queue_chunk()
+            get_metrics().stage_latency.observe(time.time() - queued_at,
+                                                tags={"stage": "queue_wait", "strategy": self.strategy_name})
+            self.client.extend_scratch(chunk_end)
+            if self.client.scratch_samples == 0:
+                continue
+            try:
+                await self.process_audio_async(vad_handle, asr_handle, final)
+            except Exception:
+                logger.exception(f"Failed processing chunk for {self.client.client_id}")
 
-        if len(self.client.buffer) > chunk_length_in_bytes:
-            if self.processing_flag:
-                logger.warning("Tried processing a new chunk while previous one is still being processed")
+    async def send_stage(self, websocket: WebSocket):
+        while True:
+            pending = await self.result_queue.get()
+            try:
+                transcription = await pending.response
+            except Exception:
+                logger.exception(f"Failed transcribing chunk for {self.client.client_id}")
+                get_metrics().chunks.inc(tags={"outcome": "failed", "strategy": self.strategy_name})
+                continue
+            finally:
+                self.client.admission_controller.asr_finished(pending.audio_seconds)
+
+            get_metrics().stage_latency.observe(time.time() - pending.submitted_at,
+                                                tags={"stage": "asr", "strategy": self.strategy_name})
+            get_metrics().chunks.inc(tags={"outcome": "transcribed", "strategy": self.strategy_name})
+
+            if pending.channels is None:
+                transcriptions = [(None, pending.language, transcription)]
             else:
-                self.client.scratch_buffer += self.client.buffer
-                self.client.buffer.clear()
-                self.processing_flag = True
-                asyncio.create_task(self.process_audio_async(web_socket, vad_handle, asr_handle))
+                transcriptions = list(zip(pending.channels, pending.channel_languages, transcription))
+
+            for channel, language, transcription in transcriptions:
+                language_message = self.client.observe_language(transcription, language, channel)
+                if language_message is not None:
+                    await websocket.send_text(json.dumps(language_message))
+
+                logger.info(f"Transcription: {transcription['text']}")
+                if transcription["text"] != "":
+                    end = time.time()
+                    transcription["processing_time"] = end - pending.start
+                    transcription["audio_end"] = pending.audio_end
+                    if channel is not None:
+                        transcription["channel"] = channel
+                    await self.client.result_encoder.send(websocket, transcription)
+
+    async def process_audio_async(self, vad_handle: DeploymentHandle, asr_handle: DeploymentHandle,
+                                  final: bool = False):
+        if self.client.channels > 1:
+            await self.process_channels_async(vad_handle, asr_handle, final)
+            return
 
-    async def process_audio_async(self, websocket: WebSocket, vad_handle: DeploymentHandle,
-                                  asr_handle: DeploymentHandle):
         start = time.time()
-        vad_results = await vad_handle.detect_activity.remote(client=self.client)
+        audio = pcm_to_float32(self.client.scratch_audio(), self.client.sampling_width)
+        if self.inline_vad_pipeline is not None and len(self.inline_vad_pipeline(audio, self.client.sampling_rate)) == 0:
+            logger.debug(f"No speech in chunk for {self.client.client_id}, skipping VAD")
+            get_metrics().chunks.inc(tags={"outcome": "silent", "strategy": self.strategy_name})
+            self.client.clear_scratch_buffer()
+            return
+
+        request = None
+        if self.streaming_vads is None:
+            request = self.create_request(audio)
+        vad_start = time.time()
+        vad_results = await self.detect_activity(vad_handle, request)
+        get_metrics().stage_latency.observe(time.time() - vad_start,
+                                            tags={"stage": "vad", "strategy": self.strategy_name})
 
         if len(vad_results) == 0:
-            self.client.buffer.clear()
-            self.client.scratch_buffer.clear()
-            self.processing_flag = False
+            get_metrics().chunks.inc(tags={"outcome": "silent", "strategy": self.strategy_name})
+            self.client.clear_scratch_buffer()
             return
 
-        last_segment_should_end_before = ((len(self.client.scratch_buffer) / (
-                self.client.sampling_rate * self.client.sampling_width)) - self.chunk_offset_seconds)
+        buffer_seconds = self.client.scratch_samples / self.client.sampling_rate
+        split_seconds = buffer_seconds if final else self.split_point(vad_results, buffer_seconds)
+        if split_seconds is None:
+            get_metrics().chunks.inc(tags={"outcome": "deferred", "strategy": self.strategy_name})
+            return
+
+        if split_seconds < buffer_seconds:
+            request = self.create_request(audio[:int(split_seconds * self.client.sampling_rate)])
+        elif request is None:
+            request = self.create_request(audio)
+
+        audio_seconds = min(split_seconds, buffer_seconds)
+        if self.asr_speech_only:
+            request.speech_segments = self.speech_regions(vad_results, audio_seconds)
+        audio_end = self.client.scratch_buffer_offset / self.client.sampling_rate + audio_seconds
+        await self.queue_transcription(PendingTranscription(asr_handle.transcribe.remote(request), start, time.time(),
+                                                            audio_seconds, audio_end, request.language))
+        self.release_transcribed(split_seconds, buffer_seconds)
+
+    async def process_channels_async(self, vad_handle: DeploymentHandle, asr_handle: DeploymentHandle,
+                                     final: bool = False):
+        """
+        process_audio_async of a multi-channel session. Every channel goes through VAD, the scratch buffer is cut
+        where all of them pause, and the channels speaking before the cut are transcribed in one ASR request.
+        """
+        start = time.time()
+        sampling_rate = self.client.sampling_rate
+        # Deinterleaved with a single copy into (channels, frames), each channel contiguous
+        audio = np.ascontiguousarray(pcm_to_float32(self.client.scratch_audio(), self.client.sampling_width)
+                                     .reshape(-1, self.client.channels).T)
+
+        channels = list(range(self.client.channels))
+        if self.inline_vad_pipeline is not None:
+            channels = [channel for channel in channels
+                        if len(self.inline_vad_pipeline(audio[channel], sampling_rate)) > 0]
+        if not channels:
+            logger.debug(f"No speech on any channel for {self.client.client_id}, skipping VAD")
+            get_metrics().chunks.inc(tags={"outcome": "silent", "strategy": self.strategy_name})
+            self.client.clear_scratch_buffer()
+            return
+
+        vad_start = time.time()
+        vad_results = await asyncio.gather(*(
+            self.detect_activity(vad_handle, self.create_request(audio[channel], channel)
+                                 if self.streaming_vads is None else None, channel)
+            for channel in channels
+        ))
+        get_metrics().stage_latency.observe(time.time() - vad_start,
+                                            tags={"stage": "vad", "strategy": self.strategy_name})
+
+        speech = {channel: results for channel, results in zip(channels, vad_results) if len(results) > 0}
+        if not speech:
+            get_metrics().chunks.inc(tags={"outcome": "silent", "strategy": self.strategy_name})
+            self.client.clear_scratch_buffer()
+            return
+
+        buffer_seconds = self.client.scratch_samples / sampling_rate
+        # A pause in the merged speech of all channels is a pause on every one of them
+        split_seconds = (buffer_seconds if final
+                         else self.split_point(self.merge_segments(speech.values()), buffer_seconds))
+        if split_seconds is None:
+            get_metrics().chunks.inc(tags={"outcome": "deferred", "strategy": self.strategy_name})
+            return
+
+        audio_seconds = min(split_seconds, buffer_seconds)
+        requests = []
+        request_channels = []
+        for channel, channel_results in speech.items():
+            regions = self.speech_regions(channel_results, audio_seconds)
+            if not regions:
+                # The channel only speaks after the cut
+                continue
+            request = self.create_request(audio[channel, :int(audio_seconds * sampling_rate)], channel)
+            if self.asr_speech_only:
+                request.speech_segments = regions
+            requests.append(request)
+            request_channels.append(channel)
+
+        audio_end = self.client.scratch_buffer_offset / sampling_rate + audio_seconds
+        await self.queue_transcription(PendingTranscription(asr_handle.transcribe_channels.remote(requests), start,
+                                                            time.time(), audio_seconds * len(requests), audio_end,
+                                                            None, request_channels,
+                                                            [request.language for request in requests]))
+        self.release_transcribed(split_seconds, buffer_seconds)
+
+    async def queue_transcription(self, pending: PendingTranscription):
+        self.client.admission_controller.asr_started(pending.audio_seconds)
+        try:
+            await self.result_queue.put(pending)
+        except asyncio.CancelledError:
+            self.client.admission_controller.asr_finished(pending.audio_seconds)
+            raise
+
+    def release_transcribed(self, split_seconds: float, buffer_seconds: float):
+        self.client.increment_file_counter()
+        if split_seconds < buffer_seconds:
+            self.client.trim_scratch_buffer(int(split_seconds * self.client.sampling_rate))
+        else:
+            self.client.clear_scratch_buffer()
+
+    def create_request(self, audio, channel: Optional[int] = None) -> AudioRequest:
+        serialization_start = time.time()
+        request = AudioRequest.from_audio(self.client, audio, self.object_store_threshold_bytes, channel)
+        get_metrics().stage_latency.observe(time.time() - serialization_start,
+                                            tags={"stage": "serialization", "strategy": self.strategy_name})
+        return request
+
+    @staticmethod
+    def merge_segments(channel_segments: Iterable[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Union of the VAD segments of several channels, in order, with overlapping segments merged
+        """
+        merged = []
+        segments = sorted((segment for segments in channel_segments for segment in segments),
+                          key=lambda segment: segment["start"])
+        for segment in segments:
+            if merged and segment["start"] <= merged[-1]["end"]:
+                merged[-1]["end"] = max(merged[-1]["end"], segment["end"])
+            else:
+                merged.append({"start": segment["start"], "end": segment["end"]})
+        return merged
+
+    def speech_regions(self, vad_results, audio_seconds: float):
+        """
+        Returns the padded and merged VAD segments inside the first audio_seconds, the only audio the ASR decodes
+        """
+        regions = []
+        for segment in vad_results:
+            start = max(segment["start"] - self.speech_pad_seconds, 0.0)
+            end = min(segment["end"] + self.speech_pad_seconds, audio_seconds)
+            if end <= start:
+                continue
+            if regions and start <= regions[-1]["end"]:
+                regions[-1]["end"] = max(regions[-1]["end"], end)
+            else:
+                regions.append({"start": start, "end": end})
+        return regions
+
+    def split_point(self, vad_results, buffer_seconds: float):
+        """
+        Returns where to cut the scratch buffer in seconds, everything before the cut is transcribed.
+        None keeps the whole buffer for the next chunk.
+        """
+        if self.ends_in_silence(vad_results, buffer_seconds):
+            return buffer_seconds
 
-        logger.info(f"Len of buffer: {len(self.client.scratch_buffer)}")
+        if buffer_seconds >= self.max_scratch_seconds:
+            logger.warning(f"Buffer of {self.client.client_id} reached {buffer_seconds:.1f}s, forcing a cut")
+            return buffer_seconds
+        return None
+
+    def ends_in_silence(self, vad_results, buffer_seconds: float) -> bool:
+        last_segment_should_end_before = buffer_seconds - self.chunk_offset_seconds
+
+        logger.info(f"Len of buffer: {self.client.scratch_samples * self.client.sampling_width}")
         logger.info(f"Last segment end: {vad_results[-1]['end']}")
         logger.info(f"Should end before: {last_segment_should_end_before}")
         logger.info(f"Condition met: {vad_results[-1]['end'] < last_segment_should_end_before}")
 
-        if vad_results[-1]["end"] < last_segment_should_end_before:
-            transcription = await asr_handle.transcribe.remote(client=self.client)
-            logger.info(f"Transcription: {transcription['text']}")
-            self.client.increment_file_counter()
-            if transcription["text"] != "":
-                end = time.time()
-                transcription["processing_time"] = end - start
-                json_transcription = json.dumps(transcription)
-                await websocket.send_text(json_transcription)
-            self.client.scratch_buffer.clear()
+        return vad_results[-1]["end"] < last_segment_should_end_before
+
+    async def detect_activity(self, vad_handle: DeploymentHandle, request: AudioRequest = None,
+                              channel: Optional[int] = None):
+        """
+        Returns the VAD segments of the scratch buffer, or of one of its channels, in seconds from the start of
+        the scratch buffer
+        """
+        if self.streaming_vads is None:
+            return await vad_handle.detect_activity.remote(request)
+
+        scratch_start = self.client.scratch_buffer_offset / self.client.sampling_rate
+        segments = await self.streaming_vads[channel or 0].detect_activity(self.client, vad_handle,
+                                                                           self.object_store_threshold_bytes, channel)
+        return [
+            {**segment, "start": max(segment["start"] - scratch_start, 0.0), "end": segment["end"] - scratch_start}
+            for segment in segments
+        ]
+
+
+class SplitAtInternalPause(SilenceAtEndOfChunk):
+    """
+    Like SilenceAtEndOfChunk, but when the buffer still ends in speech it transcribes everything up to the
+    last pause of at least min_pause_seconds and keeps only the unfinished tail. Once the buffer reaches
+    max_buffer_seconds it is cut at its longest pause, or at its end when there is none.
+    """
+
+    def __init__(self, client, **kwargs):
+        super().__init__(client, **kwargs)
+
+        self.min_pause_seconds = os.environ.get("BUFFERING_MIN_PAUSE_SECONDS")
+        if not self.min_pause_seconds:
+            self.min_pause_seconds = kwargs.get("min_pause_seconds", 0.3)
+        self.min_pause_seconds = float(self.min_pause_seconds)
+
+        self.max_buffer_seconds = os.environ.get("BUFFERING_MAX_BUFFER_SECONDS")
+        if not self.max_buffer_seconds:
+            self.max_buffer_seconds = kwargs.get("max_buffer_seconds", 15)
+        # Also bounded by the ring buffer, the forced cut here replaces SilenceAtEndOfChunk's
+        self.max_buffer_seconds = min(float(self.max_buffer_seconds), self.max_scratch_seconds)
+
+    def split_point(self, vad_results, buffer_seconds: float):
+        if self.ends_in_silence(vad_results, buffer_seconds):
+            return buffer_seconds
+
+        pauses = [
+            (current["start"] - previous["end"], (previous["end"] + current["start"]) / 2)
+            for previous, current in zip(vad_results, vad_results[1:])
+        ]
+
+        for pause_seconds, middle in reversed(pauses):
+            if pause_seconds >= self.min_pause_seconds:
+                return middle
+
+        if buffer_seconds >= self.max_buffer_seconds:
+            logger.warning(f"Buffer of {self.client.client_id} reached {buffer_seconds:.1f}s, forcing a cut")
+            return max(pauses)[1] if pauses else buffer_seconds
+
+        return None
+
+
+class LocalAgreement(BufferingStrategyInterface):
+    """
+    Re-decodes a sliding window every step_seconds of new audio. Words that two consecutive hypotheses agree
+    on are committed and sent as "final", the rest of the latest hypothesis is sent as "partial". Committed
+    audio is trimmed from the window so each decode only covers the unfinished utterance.
+    """
+
+    def __init__(self, client, **kwargs):
+        if client.channels > 1:
+            raise ValueError("local_agreement only supports single channel sessions")
+        self.client = client
+        self.strategy_name = client.config["processing_strategy"]
+
+        self.step_seconds = os.environ.get("BUFFERING_STEP_SECONDS")
+        if not self.step_seconds:
+            self.step_seconds = kwargs.get("step_seconds", 0.5)
+        self.step_seconds = float(self.step_seconds)
+
+        self.max_window_seconds = os.environ.get("BUFFERING_MAX_WINDOW_SECONDS")
+        if not self.max_window_seconds:
+            self.max_window_seconds = kwargs.get("max_window_seconds", 15)
+        self.max_window_seconds = float(self.max_window_seconds)
+
+        # Audio kept when a window has no words at all, so a word starting at the end of it is not cut
+        self.silence_keep_seconds = float(kwargs.get("silence_keep_seconds", 1.0))
+
+        self.object_store_threshold_bytes = os.environ.get("OBJECT_STORE_THRESHOLD_BYTES")
+        if not self.object_store_threshold_bytes:
+            self.object_store_threshold_bytes = kwargs.get("object_store_threshold_bytes",
+                                                           DEFAULT_OBJECT_STORE_THRESHOLD_BYTES)
+        self.object_store_threshold_bytes = int(self.object_store_threshold_bytes)
+
+        self.inline_vad_pipeline = create_inline_vad(**kwargs)
 
+        self.previous_hypothesis = []
+        # (absolute end sample, wall clock arrival time) of every piece of audio still in the window
+        self.arrivals = []
         self.processing_flag = False
+        # An end of stream waiting for the window being decoded
+        self.end_of_stream = False
+        self.task = None
+
+    def process_audio(self, web_socket: WebSocket, vad_handle: DeploymentHandle, asr_handle: DeploymentHandle):
+        step_in_samples = self.step_seconds * self.client.sampling_rate
+        self.end_of_stream = self.client.take_end_of_stream() or self.end_of_stream
+
+        if (self.client.pending_samples >= step_in_samples or self.end_of_stream) and not self.processing_flag:
+            final = self.end_of_stream
+            self.end_of_stream = False
+            self.client.extend_scratch(self.client.take_pending())
+            self.arrivals.append((self.client.scratch_end, time.time()))
+            self.processing_flag = True
+            self.task = asyncio.create_task(self.process_audio_async(web_socket, asr_handle, final))
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def process_audio_async(self, websocket: WebSocket, asr_handle: DeploymentHandle, final: bool = False):
+        try:
+            await self.decode_window(websocket, asr_handle, final)
+        except Exception:
+            logger.exception(f"Failed decoding window for {self.client.client_id}")
+        finally:
+            self.processing_flag = False
+        if self.end_of_stream:
+            self.process_audio(websocket, None, asr_handle)
+
+    async def decode_window(self, websocket: WebSocket, asr_handle: DeploymentHandle, final: bool = False):
+        """
+        Decodes the window, on the final window of a stream every word is committed and the window emptied
+        """
+        start = time.time()
+        sampling_rate = self.client.sampling_rate
+        offset = self.client.scratch_buffer_offset / sampling_rate
+        window_seconds = self.client.scratch_samples / sampling_rate
+        if window_seconds == 0:
+            return
+
+        audio = pcm_to_float32(self.client.scratch_audio(), self.client.sampling_width)
+        if (self.inline_vad_pipeline is not None and not self.previous_hypothesis
+                and len(self.inline_vad_pipeline(audio, sampling_rate)) == 0):
+            get_metrics().chunks.inc(tags={"outcome": "silent", "strategy": self.strategy_name})
+            self.trim_window(offset + window_seconds - (0.0 if final else self.silence_keep_seconds))
+            return
+
+        serialization_start = time.time()
+        request = AudioRequest.from_audio(self.client, audio, self.object_store_threshold_bytes)
+        # Agreement is on words, so they are needed whatever the session's profile
+        request.decode_options = {**(request.decode_options or {}), "word_timestamps": True}
+        get_metrics().stage_latency.observe(time.time() - serialization_start,
+                                            tags={"stage": "serialization", "strategy": self.strategy_name})
+
+        asr_start = time.time()
+        self.client.admission_controller.asr_started(window_seconds)
+        try:
+            transcription = await asr_handle.transcribe.remote(request)
+        finally:
+            self.client.admission_controller.asr_finished(window_seconds)
+        get_metrics().stage_latency.observe(time.time() - asr_start,
+                                            tags={"stage": "asr", "strategy": self.strategy_name})
+        self.client.increment_file_counter()
+
+        language_message = self.client.observe_language(transcription, request.language)
+        if language_message is not None:
+            await websocket.send_text(json.dumps(language_message))
+
+        hypothesis = [
+            {**word, "start": word["start"] + offset, "end": word["end"] + offset} for word in transcription["words"]
+        ]
+        get_metrics().chunks.inc(tags={"outcome": "transcribed", "strategy": self.strategy_name})
+        if not hypothesis:
+            self.previous_hypothesis = []
+            self.trim_window(offset + window_seconds - (0.0 if final else self.silence_keep_seconds))
+            return
+
+        committed = 0
+        while (committed < min(len(hypothesis), len(self.previous_hypothesis)) and
+               self.normalize(hypothesis[committed]) == self.normalize(self.previous_hypothesis[committed])):
+            committed += 1
+        if window_seconds >= self.max_window_seconds or final:
+            committed = len(hypothesis)
+
+        final_words = hypothesis[:committed]
+        partial_words = hypothesis[committed:]
+
+        audio_end = offset + window_seconds
+        if final_words:
+            await self.send(websocket, "final", transcription, final_words, start, audio_end)
+        if partial_words:
+            await self.send(websocket, "partial", transcription, partial_words, start, audio_end)
+
+        self.previous_hypothesis = partial_words
+        if final:
+            self.trim_window(audio_end)
+        elif final_words:
+            self.trim_window(final_words[-1]["end"])
+
+    async def send(self, websocket: WebSocket, message_type: str, transcription, words, start: float,
+                   audio_end: float):
+        now = time.time()
+        message = {
+            "type": message_type,
+            "language": transcription["language"],
+            "language_probability": transcription["language_probability"],
+            "text": "".join(word["word"] for word in words).strip(),
+            "words": words,
+            "processing_time": now - start,
+            "time_to_first_word": now - self.arrival_time(words[0]["start"]),
+            "audio_end": audio_end,
+        }
+        await self.client.result_encoder.send(websocket, message)
+
+    def arrival_time(self, seconds: float) -> float:
+        sample = int(seconds * self.client.sampling_rate)
+        for end_sample, arrived_at in self.arrivals:
+            if sample < end_sample:
+                return arrived_at
+        return self.arrivals[-1][1]
+
+    def trim_window(self, until_seconds: float):
+        num_samples = int(until_seconds * self.client.sampling_rate) - self.client.scratch_buffer_offset
+        if num_samples <= 0:
+            return
+        self.client.trim_scratch_buffer(num_samples)
+        self.arrivals = [arrival for arrival in self.arrivals if arrival[0] > self.client.scratch_buffer_offset]
+
+    @staticmethod
+    def normalize(word) -> str:
+        return word["word"].strip().lower()
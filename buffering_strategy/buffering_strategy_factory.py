@@ -1,4 +1,4 @@
-from buffering_strategy.buffering_strategies import SilenceAtEndOfChunk
+from buffering_strategy.buffering_strategies import SilenceAtEndOfChunk, LocalAgreement, SplitAtInternalPause
 from buffering_strategy.buffering_strategy_interface import BufferingStrategyInterface
 
 
@@ -11,5 +11,9 @@ class BufferingStrategyFactory:
     def create_buffering_strategies(type: str, client, **kwargs) -> BufferingStrategyInterface:
         if type == "silence_at_the_end_of_chunk":
             return SilenceAtEndOfChunk(client, **kwargs)
+        elif type == "split_at_internal_pause":
+            return SplitAtInternalPause(client, **kwargs)
+        elif type == "local_agreement":
+            return LocalAgreement(client, **kwargs)
         else:
             raise ValueError(f"Unsupported buffering strategy type:{type}")
@@ -5,3 +5,6 @@ class BufferingStrategyInterface:
 
     def process_audio(self, web_socket: WebSocket, vad_pipeline, asr_pipeline):
         raise NotImplementedError("This method should be implemented by sub class")
+
+    def close(self):
+        pass
@@ -1,19 +1,61 @@
+import logging
 import uuid
 
+import numpy as np
 from fastapi import WebSocket
 
+from admission_control import AdmissionController
+from audio_buffer import AudioRingBuffer
+from audio_decoder.audio_decoder_factory import AudioDecoderFactory
 from buffering_strategy.buffering_strategy_factory import BufferingStrategyFactory
-from typing import Dict, Any
+from decode_profiles import DecodeProfiles
+from language_lock import LanguageLock
+from metrics import get_metrics
+from result_encoder import ResultEncoder
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger("ray.serve")
 
 
 class Client:
 
-    def __init__(self, client_id, sampling_rate, sampling_width):
+    def __init__(self, client_id, sampling_rate, sampling_width, admission_controller: AdmissionController = None,
+                 decode_profiles: DecodeProfiles = None):
         self.client_id = client_id
-        self.buffer = bytearray()
-        self.scratch_buffer = bytearray()
+        self.admission_controller = admission_controller if admission_controller is not None else AdmissionController()
+        self.decode_profiles = decode_profiles if decode_profiles is not None else DecodeProfiles()
+        self.sampling_rate = sampling_rate
+        self.sampling_width = sampling_width
+        if sampling_width != 2:
+            raise ValueError(f"Unsupported sampling width: {sampling_width}")
+        # All of the session's audio lives in one ring, in absolute session sample positions:
+        # [audio.start, scratch_end) is the scratch buffer being processed, [pending_start, audio.end) is the
+        # audio not handed to the buffering strategy yet, and in between are chunks queued for processing.
+        # Positions count frames, one sample per channel.
+        self.channels = 1
+        self.audio = self.create_audio_buffer()
+        self.scratch_end = 0
+        self.pending_start = 0
         self.config = {
             "language": None,
+            # Auto language mode, used when language is None
+            "language_lock_threshold": 0.8,
+            "language_recheck_chunks": 0,
+            # Name of the ASR model registry variant, the server default when None
+            "asr_model": None,
+            # fast, balanced or accurate, the server default when None, and single options overriding it
+            "decode_profile": None,
+            "decode_options": {},
+            # Channels of the audio the client sends, interleaved, e.g. 2 for agent and customer of a call.
+            # Each channel goes through VAD on its own and results are tagged with their channel.
+            "channels": 1,
+            # Codec and arguments of the audio the client sends, decoded to 16-bit PCM at sampling_rate
+            "input_format": {
+                "codec": "pcm_s16le",
+            },
+            # json, msgpack or binary, see result_encoder
+            "result_encoding": "json",
+            "incremental_words": False,
             "processing_strategy": "silence_at_the_end_of_chunk",
             "processing_args": {
                 "chunk_length_seconds": 3,
@@ -22,29 +64,242 @@ class Client:
         }
         self.file_counter = 0
         self.total_samples = 0
-        self.sampling_rate = sampling_rate
-        self.sampling_width = sampling_width
+        self.dropped_samples = 0
+        self.slow_down_sent = False
+        # Set by an end_of_stream message until the buffering strategy picked it up
+        self.end_of_stream = False
+        self.language_locks = self.create_language_locks(self.config, self.channels)
+        self.decode_options = self.decode_profiles.resolve(self.config["decode_profile"], self.config["decode_options"])
+        self.decoder = self.create_decoder()
+        self.result_encoder = ResultEncoder(self.config["result_encoding"], self.config["incremental_words"])
         self.buffering_strategy = BufferingStrategyFactory.create_buffering_strategies(
             self.config["processing_strategy"], self, **self.config["processing_args"])
 
+    def create_decoder(self):
+        input_format = dict(self.config["input_format"])
+        return AudioDecoderFactory.create_audio_decoder(input_format.pop("codec"), self.sampling_rate, self.channels,
+                                                        **input_format)
+
+    @staticmethod
+    def create_language_locks(config: Dict[str, Any], channels: int) -> List[LanguageLock]:
+        """
+        One language lock per channel, the speakers of a call may not share a language
+        """
+        return [LanguageLock(float(config["language_lock_threshold"]), int(config["language_recheck_chunks"]))
+                for _ in range(channels)]
+
+    def create_audio_buffer(self, position: int = 0) -> AudioRingBuffer:
+        return AudioRingBuffer(int(self.admission_controller.ring_buffer_seconds * self.sampling_rate),
+                               self.channels, position)
+
     def update_config(self, config_data: Dict[str, Any]):
-        self.config.update(config_data)
-        self.buffering_strategy = BufferingStrategyFactory.create_buffering_strategies(
-            self.config["processing_strategy"], self, **self.config["processing_args"])
+        """
+        Applies a config message. Everything is validated and built before the session changes, a ValueError
+        leaves the session on its previous config.
+        """
+        config = {**self.config, **config_data}
+        previous_config, previous_channels = self.config, self.channels
+        decoder = None
+        try:
+            channels = int(config["channels"])
+            if not 1 <= channels <= self.admission_controller.max_channels:
+                raise ValueError(f"Unsupported channel count {channels}, "
+                                 f"at most {self.admission_controller.max_channels} are allowed")
+            if config_data.keys() & {"language", "language_lock_threshold", "language_recheck_chunks"}:
+                language_locks = self.create_language_locks(config, channels)
+            else:
+                # Other config changes keep the languages locked so far, channels added start detecting
+                language_locks = (self.language_locks[:channels] +
+                                  self.create_language_locks(config, channels - len(self.language_locks)))
+            decode_options = self.decode_profiles.resolve(config["decode_profile"], config["decode_options"])
+            result_encoder = ResultEncoder(config["result_encoding"], bool(config["incremental_words"]))
+
+            # The decoder and the strategy are built from the session's config and channels
+            self.config, self.channels = config, channels
+            if "input_format" in config_data or channels != previous_channels:
+                decoder = self.create_decoder()
+            buffering_strategy = BufferingStrategyFactory.create_buffering_strategies(
+                config["processing_strategy"], self, **config["processing_args"])
+        except (KeyError, TypeError, ValueError) as e:
+            self.config, self.channels = previous_config, previous_channels
+            if decoder is not None:
+                decoder.close()
+            raise ValueError(f"Invalid config: {e}") from e
+
+        if channels != previous_channels:
+            # Audio buffered so far has the old layout and is dropped, positions carry on
+            self.audio = self.create_audio_buffer(self.audio.end)
+            self.scratch_end = self.pending_start = self.audio.end
+        if decoder is not None:
+            self.decoder.close()
+            self.decoder = decoder
+        self.language_locks = language_locks
+        self.decode_options = decode_options
+        self.result_encoder = result_encoder
+        self.buffering_strategy.close()
+        self.buffering_strategy = buffering_strategy
+
+    @property
+    def scratch_buffer_offset(self) -> int:
+        """
+        Absolute session position of the first sample of the scratch buffer
+        """
+        return self.audio.start
+
+    @property
+    def scratch_samples(self) -> int:
+        return self.scratch_end - self.audio.start
+
+    @property
+    def pending_samples(self) -> int:
+        return self.audio.end - self.pending_start
+
+    @property
+    def buffered_bytes(self) -> int:
+        return len(self.audio) * self.sampling_width * self.channels
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.audio.nbytes
+
+    def scratch_audio(self) -> np.ndarray:
+        """
+        The scratch buffer as 16-bit samples, or (frames, channels) with several channels, a view of the ring
+        that is only valid until new audio arrives
+        """
+        return self.audio.view(self.audio.start, self.scratch_end)
 
-    def append_audio_data(self, audio_data: bytes):
-        self.buffer.extend(audio_data)
-        self.total_samples += len(audio_data) / self.sampling_width
+    def take_pending(self) -> int:
+        """
+        Hands all pending audio to the buffering strategy, returns the absolute position it ends at
+        """
+        self.pending_start = self.audio.end
+        return self.pending_start
+
+    def extend_scratch(self, until: int):
+        self.scratch_end = max(self.scratch_end, min(until, self.audio.end))
+
+    def append_audio_data(self, audio_data: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Appends audio to the buffer within the session buffer limit, returns a control message for the
+        websocket when the buffer policy asks for one
+        """
+        return self.append_pcm(self.decoder.decode(audio_data))
+
+    def end_stream(self) -> Optional[Dict[str, Any]]:
+        """
+        Appends the audio the decoder still holds and marks the end of the stream, so the buffering strategy
+        transcribes everything left in the buffer. Audio sent afterwards starts a new stream.
+        """
+        control_message = self.append_pcm(self.decoder.flush())
+        self.decoder.close()
+        self.decoder = self.create_decoder()
+        self.end_of_stream = True
+        return control_message
+
+    def take_end_of_stream(self) -> bool:
+        end_of_stream = self.end_of_stream
+        self.end_of_stream = False
+        return end_of_stream
+
+    def append_pcm(self, pcm: bytes) -> Optional[Dict[str, Any]]:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if self.channels > 1:
+            # Frames stay interleaved in the ring, channels are split when a chunk is processed
+            samples = samples.reshape(-1, self.channels)
+        self.total_samples += len(samples)
+
+        max_buffer_seconds = self.admission_controller.max_session_buffer_seconds
+        if max_buffer_seconds is None:
+            self.write(samples)
+            return None
+
+        max_buffer_samples = int(max_buffer_seconds * self.sampling_rate)
+        buffer_policy = self.admission_controller.buffer_policy
+        overflow = self.pending_samples + len(samples) - max_buffer_samples
+
+        if overflow <= 0:
+            self.write(samples)
+            self.slow_down_sent = False
+            return None
+
+        if buffer_policy == "drop_oldest":
+            overflow = min(overflow, self.pending_samples)
+            self.audio.remove(self.pending_start, overflow)
+            self.write(samples)
+            self.dropped_samples += overflow
+            get_metrics().dropped_audio_seconds.inc(overflow / self.sampling_rate, tags={"policy": buffer_policy})
+            return None
+
+        if buffer_policy == "slow_down" and self.pending_samples + len(samples) <= 2 * max_buffer_samples:
+            # Keep accepting audio, up to twice the limit, while the client backs off
+            self.write(samples)
+            if self.slow_down_sent:
+                return None
+            self.slow_down_sent = True
+            return {"type": "slow_down", "buffered_seconds": self.pending_samples / self.sampling_rate}
+
+        self.dropped_samples += len(samples)
+        get_metrics().dropped_audio_seconds.inc(len(samples) / self.sampling_rate, tags={"policy": buffer_policy})
+        return {"type": "status", "status": "rejected", "reason": "buffer_full"}
+
+    def write(self, samples: np.ndarray):
+        overflow = self.audio.write(samples)
+        if overflow > 0:
+            # The ring is full, the oldest audio, possibly still being processed, was released
+            logger.warning(f"Ring buffer of {self.client_id} overflowed, dropped {overflow} samples")
+            self.dropped_samples += overflow
+            get_metrics().dropped_audio_seconds.inc(overflow / self.sampling_rate, tags={"policy": "ring_overflow"})
+            self.scratch_end = max(self.scratch_end, self.audio.start)
+            self.pending_start = max(self.pending_start, self.audio.start)
 
     def clear_buffer(self):
-        self.buffer.clear()
+        self.audio.truncate(self.pending_start)
+
+    def clear_scratch_buffer(self):
+        self.audio.release(self.scratch_end)
+
+    def trim_scratch_buffer(self, num_samples: int):
+        self.audio.release(self.audio.start + min(num_samples, self.scratch_samples))
+
+    def request_language(self, channel: Optional[int] = None) -> Optional[str]:
+        """
+        Language to send with the next ASR request, the configured one or the one locked for the channel
+        """
+        if self.config["language"] is not None:
+            return self.config["language"]
+        return self.language_locks[channel or 0].request_language()
+
+    def observe_language(self, transcription: Dict[str, Any], request_language: Optional[str],
+                         channel: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        Feeds a transcription to the channel's language lock, returns a control message when its locked
+        language changed
+        """
+        if self.config["language"] is not None:
+            return None
+        message = self.language_locks[channel or 0].observe(transcription.get("language"),
+                                                            transcription.get("language_probability"),
+                                                            detected=request_language is None)
+        if message is not None and channel is not None:
+            message["channel"] = channel
+        return message
 
     def increment_file_counter(self):
         self.file_counter += 1
 
-    def get_file_name(self):
+    def get_file_name(self, channel: Optional[int] = None):
         new_uuid = uuid.uuid4()
+        if channel is not None:
+            return f"{self.client_id}_{self.file_counter}_{channel}.wav"
         return f"{self.client_id}_{self.file_counter}.wav"
 
     def process_audio(self, websocket: WebSocket, vad_pipeline, asr_pipeline):
         self.buffering_strategy.process_audio(websocket, vad_pipeline, asr_pipeline)
+
+    def close(self):
+        self.buffering_strategy.close()
+        self.decoder.close()
+        if self.decoder.decode_seconds > 0:
+            logger.info(f"Client {self.client_id} spent {self.decoder.decode_seconds:.2f}s decoding "
+                        f"{self.config['input_format']['codec']} audio")
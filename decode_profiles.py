@@ -0,0 +1,87 @@
+from typing import Any, Dict, List, Optional
+
+# faster-whisper transcribe() arguments a decode profile sets
+DECODE_OPTIONS = ("beam_size", "best_of", "word_timestamps", "temperature", "condition_on_previous_text",
+                  "no_speech_threshold", "log_prob_threshold", "compression_ratio_threshold")
+
+DECODE_PROFILES = {
+    # Greedy, no alignment pass and no temperature fallback
+    "fast": {
+        "beam_size": 1,
+        "best_of": 1,
+        "word_timestamps": False,
+        "temperature": [0.0],
+        "condition_on_previous_text": False,
+        "no_speech_threshold": 0.6,
+        "log_prob_threshold": -1.0,
+        "compression_ratio_threshold": 2.4,
+    },
+    "balanced": {
+        "beam_size": 2,
+        "best_of": 2,
+        "word_timestamps": True,
+        "temperature": [0.0, 0.4, 0.8],
+        "condition_on_previous_text": False,
+        "no_speech_threshold": 0.6,
+        "log_prob_threshold": -1.0,
+        "compression_ratio_threshold": 2.4,
+    },
+    # The faster-whisper defaults
+    "accurate": {
+        "beam_size": 5,
+        "best_of": 5,
+        "word_timestamps": True,
+        "temperature": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+        "condition_on_previous_text": True,
+        "no_speech_threshold": 0.6,
+        "log_prob_threshold": -1.0,
+        "compression_ratio_threshold": 2.4,
+    },
+}
+
+DEFAULT_DECODE_PROFILE = "accurate"
+
+
+class DecodeProfiles:
+    """
+    Decode profiles sessions may pick in their config message and the limits the server puts on them. A session
+    picks a profile by name and may override single options of it, the result is clamped to the limits.
+    """
+
+    def __init__(self, default_profile: str = DEFAULT_DECODE_PROFILE, allowed_profiles: Optional[List[str]] = None,
+                 max_beam_size: int = 5, max_best_of: int = 5, max_temperature_fallbacks: int = 5):
+        self.allowed_profiles = list(allowed_profiles) if allowed_profiles else list(DECODE_PROFILES)
+        for profile in self.allowed_profiles:
+            if profile not in DECODE_PROFILES:
+                raise ValueError(f"Unknown decode profile: {profile}")
+        if default_profile not in self.allowed_profiles:
+            raise ValueError(f"Default decode profile {default_profile} is not an allowed profile")
+
+        self.default_profile = default_profile
+        self.max_beam_size = max_beam_size
+        self.max_best_of = max_best_of
+        self.max_temperature_fallbacks = max_temperature_fallbacks
+
+    def resolve(self, profile: Optional[str] = None, overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Decode options of the profile, the server default when None, with the overrides applied within the limits
+        """
+        profile = profile or self.default_profile
+        if profile not in DECODE_PROFILES:
+            raise ValueError(f"Unknown decode profile: {profile}")
+        if profile not in self.allowed_profiles:
+            raise ValueError(f"Decode profile {profile} is not allowed on this server")
+
+        overrides = overrides or {}
+        unknown = set(overrides) - set(DECODE_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown decode options: {', '.join(sorted(unknown))}")
+
+        options = {**DECODE_PROFILES[profile], **overrides}
+        options["beam_size"] = min(max(int(options["beam_size"]), 1), self.max_beam_size)
+        options["best_of"] = min(max(int(options["best_of"]), 1), self.max_best_of)
+        temperature = options["temperature"]
+        temperature = [float(t) for t in temperature] if isinstance(temperature, (list, tuple)) else [float(temperature)]
+        options["temperature"] = temperature[:1 + self.max_temperature_fallbacks]
+        options["word_timestamps"] = bool(options["word_timestamps"])
+        return options
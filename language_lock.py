@@ -0,0 +1,54 @@
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("ray.serve")
+
+
+class LanguageLock:
+    """
+    Auto language mode of one session: the ASR detects the language until it is confident enough, then the
+    language is locked and passed with every request so detection is skipped. With recheck_every_chunks set,
+    every that many chunks one request goes out without a language to confirm the lock or move it.
+    """
+
+    def __init__(self, threshold: float = 0.8, recheck_every_chunks: int = 0):
+        self.threshold = threshold
+        self.recheck_every_chunks = recheck_every_chunks
+
+        self.language: Optional[str] = None
+        self.language_probability: Optional[float] = None
+        self.chunks_since_detection = 0
+
+    def request_language(self) -> Optional[str]:
+        """
+        Returns the language to decode the next chunk with, None asks the ASR to detect it
+        """
+        if self.language is None:
+            return None
+        if self.recheck_every_chunks > 0 and self.chunks_since_detection >= self.recheck_every_chunks:
+            return None
+        return self.language
+
+    def observe(self, language: Optional[str], language_probability: Optional[float],
+                detected: bool) -> Optional[Dict[str, Any]]:
+        """
+        Records the language of a transcription, detected tells whether the ASR detected it or was given it.
+        Returns a control message for the client when the lock was set or moved.
+        """
+        if not detected or language is None or language_probability is None:
+            self.chunks_since_detection += 1
+            return None
+
+        self.chunks_since_detection = 0
+        if language == self.language or language_probability < self.threshold:
+            return None
+
+        logger.info(f"Locking language {language} (probability {language_probability:.2f}), was {self.language}")
+        self.language = language
+        self.language_probability = language_probability
+        return {
+            "type": "language",
+            "language": language,
+            "language_probability": language_probability,
+            "locked": True,
+        }
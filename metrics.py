@@ -0,0 +1,129 @@
+from typing import Optional
+
+from ray.serve import metrics
+
+LATENCY_BOUNDARIES = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+REAL_TIME_FACTOR_BOUNDARIES = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5]
+BUFFER_BYTES_BOUNDARIES = [32_000, 96_000, 320_000, 960_000, 3_200_000, 9_600_000]
+
+
+class TranscriptionMetrics:
+    """
+    Prometheus metrics of the transcription pipeline, exported through Ray Serve. Ray Serve adds the
+    deployment, replica and application tags to every metric.
+    """
+
+    def __init__(self):
+        self.stage_latency = metrics.Histogram(
+            "transcription_stage_latency_seconds",
+            description="Latency of one pipeline stage per chunk: queue_wait, serialization, vad, asr, "
+                        "vad_inference, asr_inference",
+            boundaries=LATENCY_BOUNDARIES,
+            tag_keys=("stage", "model_size", "strategy"),
+        )
+        self.stage_latency.set_default_tags({"model_size": "", "strategy": ""})
+
+        self.audio_seconds = metrics.Counter(
+            "transcription_audio_seconds_total",
+            description="Seconds of audio processed by a stage",
+            tag_keys=("stage", "model_size"),
+        )
+        self.audio_seconds.set_default_tags({"model_size": ""})
+
+        self.real_time_factor = metrics.Histogram(
+            "transcription_real_time_factor",
+            description="Inference time divided by audio duration",
+            boundaries=REAL_TIME_FACTOR_BOUNDARIES,
+            tag_keys=("stage", "model_size"),
+        )
+        self.real_time_factor.set_default_tags({"model_size": ""})
+
+        self.chunks = metrics.Counter(
+            "transcription_chunks_total",
+            description="Chunks by outcome: transcribed, deferred, silent or failed",
+            tag_keys=("outcome", "strategy"),
+        )
+
+        self.dropped_audio_seconds = metrics.Counter(
+            "transcription_dropped_audio_seconds_total",
+            description="Seconds of audio dropped by the session buffer policy",
+            tag_keys=("policy",),
+        )
+
+        self.decode_seconds = metrics.Counter(
+            "transcription_decode_seconds_total",
+            description="CPU seconds spent decoding and resampling client audio on the ingress",
+            tag_keys=("codec",),
+        )
+
+        self.cache_requests = metrics.Counter(
+            "transcription_cache_requests_total",
+            description="Transcription cache lookups by tier (local, cluster) and outcome (hit, miss)",
+            tag_keys=("tier", "outcome"),
+        )
+
+        self.cache_bytes = metrics.Gauge(
+            "transcription_cache_bytes",
+            description="Size of the results held by the replica's transcription cache",
+        )
+
+        self.session_buffer_bytes = metrics.Histogram(
+            "transcription_session_buffer_bytes",
+            description="Bytes of audio buffered by a session, observed each time a chunk is queued",
+            boundaries=BUFFER_BYTES_BOUNDARIES,
+            tag_keys=("strategy",),
+        )
+
+        self.active_sessions = metrics.Gauge(
+            "transcription_active_sessions",
+            description="Active websocket sessions on the ingress replica",
+        )
+
+        self.session_memory_bytes = metrics.Gauge(
+            "transcription_session_memory_bytes",
+            description="Audio ring buffer memory allocated by the sessions of the ingress replica",
+        )
+
+        self.pending_audio_seconds = metrics.Gauge(
+            "transcription_pending_audio_seconds",
+            description="Seconds of audio accepted by an ASR or VAD replica and not answered yet",
+        )
+
+        self.model_memory_bytes = metrics.Gauge(
+            "transcription_model_memory_bytes",
+            description="Resident memory the ASR replica grew by loading its model",
+            tag_keys=("model",),
+        )
+
+        self.model_chunk_latency = metrics.Gauge(
+            "transcription_model_chunk_latency_seconds",
+            description="Latency of one chunk measured when the ASR replica started",
+            tag_keys=("model",),
+        )
+
+        self.time_to_ready = metrics.Gauge(
+            "transcription_replica_time_to_ready_seconds",
+            description="Startup time of a model replica by stage: load from __init__ start to the model loaded, "
+                        "warmup, and process from the process start to ready",
+            tag_keys=("stage",),
+        )
+
+    def observe_inference(self, stage: str, model_size: str, seconds: float, audio_seconds: float):
+        tags = {"stage": stage, "model_size": model_size}
+        self.stage_latency.observe(seconds, tags=tags)
+        self.audio_seconds.inc(audio_seconds, tags=tags)
+        if audio_seconds > 0:
+            self.real_time_factor.observe(seconds / audio_seconds, tags=tags)
+
+
+_metrics: Optional[TranscriptionMetrics] = None
+
+
+def get_metrics() -> TranscriptionMetrics:
+    """
+    Metrics are created on first use, inside the replica, so Ray Serve can tag them with the deployment
+    """
+    global _metrics
+    if _metrics is None:
+        _metrics = TranscriptionMetrics()
+    return _metrics
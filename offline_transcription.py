@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import ray
+from ray.serve.handle import DeploymentHandle
+
+from admission_control import AdmissionController
+from audio_decoder.audio_decoders import decode_audio_file
+from audio_request import AudioRequest
+
+logger = logging.getLogger("ray.serve")
+
+
+@dataclass
+class TranscriptionJob:
+    job_id: str
+    file_names: List[str]
+    language: Optional[str] = None
+    decode_options: Optional[Dict[str, Any]] = None
+    asr_model: Optional[str] = None
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    total_segments: int = 0
+    completed_segments: int = 0
+    audio_seconds: float = 0.0
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+    # Set and replaced on every progress change, so streaming readers can wait for the next one
+    updated: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def notify(self):
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "files": self.file_names,
+            "asr_model": self.asr_model,
+            "total_segments": self.total_segments,
+            "completed_segments": self.completed_segments,
+            "audio_seconds": self.audio_seconds,
+            "elapsed_seconds": (self.finished_at or time.time()) - self.created_at,
+            "error": self.error,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = self.progress()
+        if self.status == "completed":
+            job["results"] = self.results
+        return job
+
+
+class OfflineTranscriber:
+    """
+    Transcribes whole recordings: the audio is cut into VAD windows and ASR segments that are all sent at
+    once, so Ray Serve spreads them over every VAD and ASR replica, then the segment results are stitched
+    into one transcript with timestamps from the start of the file. Jobs live in memory on this replica.
+    """
+
+    def __init__(self, vad_handle: DeploymentHandle, asr_handle: DeploymentHandle,
+                 admission_controller: AdmissionController,
+                 asr_models: Optional[Dict[str, DeploymentHandle]] = None, sampling_rate: int = 16000,
+                 max_segment_seconds: float = 28.0, vad_window_seconds: float = 300.0,
+                 max_concurrent_segments: int = 64, max_jobs: int = 100, speech_pad_seconds: float = 0.2,
+                 language_lock_threshold: float = 0.8):
+        self.vad_handle = vad_handle
+        self.asr_handle = asr_handle
+        self.asr_models = asr_models or {}
+        self.admission_controller = admission_controller
+        self.sampling_rate = sampling_rate
+        self.max_segment_seconds = max_segment_seconds
+        self.vad_window_seconds = vad_window_seconds
+        self.speech_pad_seconds = speech_pad_seconds
+        self.language_lock_threshold = language_lock_threshold
+        self.max_jobs = max_jobs
+        # Shared by all jobs so one large backlog cannot queue unbounded work on the ASR replicas
+        self.segment_semaphore = asyncio.Semaphore(max_concurrent_segments)
+
+        self.jobs: "OrderedDict[str, TranscriptionJob]" = OrderedDict()
+        self.tasks = set()
+
+    def submit(self, files: List[Tuple[str, bytes]], language: Optional[str] = None,
+               decode_options: Optional[Dict[str, Any]] = None, asr_model: Optional[str] = None) -> TranscriptionJob:
+        job = TranscriptionJob(job_id=str(uuid.uuid4()), file_names=[name for name, _ in files], language=language,
+                               decode_options=decode_options, asr_model=asr_model)
+        self.jobs[job.job_id] = job
+        self.evict_jobs()
+
+        task = asyncio.create_task(self.run_job(job, files))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[TranscriptionJob]:
+        return self.jobs.get(job_id)
+
+    def evict_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("completed", "failed")]
+        while len(self.jobs) > self.max_jobs and finished:
+            del self.jobs[finished.pop(0)]
+
+    async def run_job(self, job: TranscriptionJob, files: List[Tuple[str, bytes]]):
+        job.status = "running"
+        job.notify()
+        try:
+            job.results = await asyncio.gather(*(self.transcribe_file(job, name, data) for name, data in files))
+            job.status = "completed"
+        except Exception as e:
+            logger.exception(f"Offline transcription job {job.job_id} failed")
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        job.finished_at = time.time()
+        job.notify()
+
+    async def transcribe_file(self, job: TranscriptionJob, file_name: str, data: bytes) -> Dict[str, Any]:
+        audio = await asyncio.to_thread(decode_audio_file, data, self.sampling_rate)
+        duration = len(audio) / self.sampling_rate
+        job.audio_seconds += duration
+
+        speech = await self.detect_speech(job, file_name, audio)
+        segments = self.plan_segments(speech, duration)
+        job.total_segments += len(segments)
+        job.notify()
+
+        language = job.language
+        results: List[Optional[Dict[str, Any]]] = [None] * len(segments)
+        if segments and language is None:
+            # Detect on the first segment and decode the rest in that language, one detection per file
+            results[0] = await self.transcribe_segment(job, file_name, 0, audio, segments[0], None)
+            if (results[0].get("language_probability") or 0.0) >= self.language_lock_threshold:
+                language = results[0]["language"]
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        transcribed = await asyncio.gather(*(
+            self.transcribe_segment(job, file_name, i, audio, segments[i], language) for i in pending
+        ))
+        for i, result in zip(pending, transcribed):
+            results[i] = result
+
+        return self.stitch(file_name, duration, segments, results)
+
+    async def detect_speech(self, job: TranscriptionJob, file_name: str, audio: np.ndarray) -> List[Dict[str, float]]:
+        """
+        Runs VAD over windows of the recording in parallel, returns the speech segments in file seconds
+        """
+        window = int(self.vad_window_seconds * self.sampling_rate)
+        starts = list(range(0, len(audio), window))
+        window_segments = await asyncio.gather(*(
+            self.vad_handle.detect_activity.remote(self.create_request(
+                job, f"{file_name}_vad_{start // window}", audio[start:start + window]))
+            for start in starts
+        ))
+
+        speech = []
+        for start, segments in zip(starts, window_segments):
+            offset = start / self.sampling_rate
+            for segment in segments:
+                segment = {"start": segment["start"] + offset, "end": segment["end"] + offset}
+                if speech and segment["start"] - speech[-1]["end"] < 0.1:
+                    # Joins speech that a window boundary cut in two
+                    speech[-1]["end"] = max(speech[-1]["end"], segment["end"])
+                else:
+                    speech.append(segment)
+        return speech
+
+    def plan_segments(self, speech: List[Dict[str, float]], duration: float) -> List[Dict[str, Any]]:
+        """
+        Groups speech into ASR segments of at most max_segment_seconds, cut in the pauses between speech.
+        Every segment keeps its padded speech regions, relative to the segment start.
+        """
+        segments = []
+        for region in speech:
+            start = max(region["start"] - self.speech_pad_seconds, 0.0)
+            end = min(region["end"] + self.speech_pad_seconds, duration)
+            # Speech longer than one segment is cut at fixed length
+            while end - start > self.max_segment_seconds:
+                segments.append({"start": start, "end": start + self.max_segment_seconds,
+                                 "speech": [(start, start + self.max_segment_seconds)]})
+                start += self.max_segment_seconds
+            if end <= start:
+                continue
+
+            if segments and end - segments[-1]["start"] <= self.max_segment_seconds:
+                segments[-1]["end"] = end
+                previous = segments[-1]["speech"][-1]
+                if start <= previous[1]:
+                    segments[-1]["speech"][-1] = (previous[0], max(previous[1], end))
+                else:
+                    segments[-1]["speech"].append((start, end))
+            else:
+                segments.append({"start": start, "end": end, "speech": [(start, end)]})
+
+        return [
+            {
+                "start": segment["start"],
+                "end": segment["end"],
+                "speech_segments": [{"start": s - segment["start"], "end": e - segment["start"]}
+                                    for s, e in segment["speech"]],
+            }
+            for segment in segments
+        ]
+
+    async def transcribe_segment(self, job: TranscriptionJob, file_name: str, index: int, audio: np.ndarray,
+                                 segment: Dict[str, Any], language: Optional[str]) -> Dict[str, Any]:
+        segment_seconds = segment["end"] - segment["start"]
+        request = self.create_request(
+            job, f"{file_name}_{index}",
+            audio[int(segment["start"] * self.sampling_rate):int(segment["end"] * self.sampling_rate)], language)
+        request.speech_segments = segment["speech_segments"]
+
+        async with self.segment_semaphore:
+            self.admission_controller.asr_started(segment_seconds)
+            try:
+                result = await self.asr_models.get(job.asr_model, self.asr_handle).transcribe.remote(request)
+            finally:
+                self.admission_controller.asr_finished(segment_seconds)
+
+        job.completed_segments += 1
+        job.notify()
+        return result
+
+    def create_request(self, job: TranscriptionJob, file_name: str, audio: np.ndarray,
+                       language: Optional[str] = None) -> AudioRequest:
+        return AudioRequest(
+            client_id=job.job_id,
+            file_name=f"{job.job_id}_{file_name}.wav",
+            audio=ray.put(audio),
+            sampling_rate=self.sampling_rate,
+            language=language if language is not None else job.language,
+            decode_options=job.decode_options,
+            num_samples=len(audio),
+        )
+
+    @staticmethod
+    def stitch(file_name: str, duration: float, segments: List[Dict[str, Any]],
+               results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        words = []
+        texts = []
+        languages: Dict[str, int] = {}
+        for segment, result in zip(segments, results):
+            if result["text"]:
+                texts.append(result["text"])
+            if result.get("language"):
+                languages[result["language"]] = languages.get(result["language"], 0) + 1
+            if isinstance(result["words"], list):
+                words.extend({**word, "start": word["start"] + segment["start"], "end": word["end"] + segment["start"]}
+                             for word in result["words"])
+
+        return {
+            "file_name": file_name,
+            "duration": duration,
+            "language": max(languages, key=languages.get) if languages else None,
+            "text": " ".join(texts),
+            "words": words,
+            "segments": [
+                {"start": segment["start"], "end": segment["end"], "text": result["text"]}
+                for segment, result in zip(segments, results)
+            ],
+        }
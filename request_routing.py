@@ -0,0 +1,103 @@
+import random
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from ray.serve.config import RequestRouterConfig
+from ray.serve.request_router import FIFOMixin, PendingRequest, ReplicaID, ReplicaResult, RequestRouter, \
+    RunningReplica
+
+from audio_request import AudioRequest
+from metrics import get_metrics
+
+PENDING_AUDIO_SECONDS = "pending_audio_seconds"
+
+
+def _request_audio_seconds(pending_request: Optional[PendingRequest]) -> float:
+    if pending_request is None:
+        return 0.0
+    for arg in list(pending_request.args) + list(pending_request.kwargs.values()):
+        if isinstance(arg, AudioRequest):
+            return arg.audio_seconds
+        if isinstance(arg, list) and arg and all(isinstance(request, AudioRequest) for request in arg):
+            # The channels of a multi-channel session
+            return sum(request.audio_seconds for request in arg)
+    return 0.0
+
+
+class AudioSecondsRequestRouter(FIFOMixin, RequestRouter):
+    """
+    Routes each request to the replica with the fewest seconds of audio waiting on it, instead of the fewest
+    requests. The load of a replica is the larger of the audio this handle routed to it and not yet answered,
+    and the pending audio the replica itself reported, which also covers the other ingress replicas.
+    """
+
+    def initialize_state(self, **kwargs):
+        self.routed_audio_seconds: Dict[ReplicaID, float] = {}
+
+    def replica_load(self, replica: RunningReplica) -> float:
+        reported = (replica.routing_stats or {}).get(PENDING_AUDIO_SECONDS, 0.0)
+        return max(self.routed_audio_seconds.get(replica.replica_id, 0.0), reported)
+
+    async def choose_replicas(self, candidate_replicas: List[RunningReplica],
+                              pending_request: Optional[PendingRequest] = None) -> List[List[RunningReplica]]:
+        # Shuffled first so replicas with the same load share the traffic
+        replicas = random.sample(candidate_replicas, len(candidate_replicas))
+        # One rank per replica, the next one is tried when the least loaded is at max_ongoing_requests
+        return [[replica] for replica in sorted(replicas, key=self.replica_load)]
+
+    def on_request_routed(self, pending_request: PendingRequest, replica_id: ReplicaID, result: ReplicaResult):
+        audio_seconds = _request_audio_seconds(pending_request)
+        if audio_seconds <= 0:
+            return
+
+        self.routed_audio_seconds[replica_id] = self.routed_audio_seconds.get(replica_id, 0.0) + audio_seconds
+        loop = self._event_loop
+        # Completion callbacks run on a Ray thread
+        result.add_done_callback(
+            lambda _: loop.call_soon_threadsafe(self.on_request_finished, replica_id, audio_seconds))
+
+    def on_request_finished(self, replica_id: ReplicaID, audio_seconds: float):
+        if replica_id not in self.routed_audio_seconds:
+            return
+        remaining = self.routed_audio_seconds[replica_id] - audio_seconds
+        if remaining > 1e-6:
+            self.routed_audio_seconds[replica_id] = remaining
+        else:
+            del self.routed_audio_seconds[replica_id]
+
+    def on_replica_actor_died(self, replica_id: ReplicaID):
+        super().on_replica_actor_died(replica_id)
+        self.routed_audio_seconds.pop(replica_id, None)
+
+
+def audio_seconds_router_config(stats_period_s: float = 1.0) -> RequestRouterConfig:
+    return RequestRouterConfig(
+        request_router_class=AudioSecondsRequestRouter,
+        request_routing_stats_period_s=stats_period_s,
+        request_routing_stats_timeout_s=stats_period_s,
+    )
+
+
+class PendingAudioStats:
+    """
+    Deployment mixin that counts the seconds of audio a replica accepted and has not answered yet, reports them
+    to the request router and exports them as the pending_audio_seconds gauge. Ray Serve 2.50 autoscaling
+    policies do not receive custom replica metrics, so autoscaling stays on ongoing requests.
+    """
+
+    pending_audio_seconds: float = 0.0
+
+    @asynccontextmanager
+    async def pending_audio(self, audio_seconds: float):
+        self.set_pending_audio(self.pending_audio_seconds + audio_seconds)
+        try:
+            yield
+        finally:
+            self.set_pending_audio(max(0.0, self.pending_audio_seconds - audio_seconds))
+
+    def set_pending_audio(self, seconds: float):
+        self.pending_audio_seconds = seconds
+        get_metrics().pending_audio_seconds.set(seconds)
+
+    def record_routing_stats(self) -> Dict[str, Any]:
+        return {PENDING_AUDIO_SECONDS: self.pending_audio_seconds}
@@ -0,0 +1,120 @@
+"""
+Encodings of the results sent to a session, picked with "result_encoding" in the config message:
+
+json     the result dict as a text frame, the default
+msgpack  a binary frame holding a MessagePack map, words are [word, start_ms, end_ms, probability] arrays
+binary   a binary frame with the fixed little-endian layout below
+
+    header  2s magic b"TR", B version, B type (0 transcription, 1 final, 2 partial), B channel, H keep,
+            H word count, f language_probability, I processing_time_ms, I audio_end_ms, 4s language,
+            I text length
+    text    utf-8
+    word    I start_ms, I end_ms, H probability * 65534 or 0xFFFF when unknown, B word length, then the utf-8 word
+
+Results of multi-channel sessions carry their "channel", the binary channel is 0 for single channel sessions.
+With "incremental_words" set, "keep" is the number of leading words the message shares with the previous
+result of the same channel sent to the session and only the words after them are sent. The client rebuilds
+the full list as previous_words[:keep] + words. Control messages are always JSON text frames.
+"""
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import msgpack
+from fastapi import WebSocket
+
+RESULT_ENCODINGS = ("json", "msgpack", "binary")
+BINARY_VERSION = 3
+BINARY_MESSAGE_TYPES = {"transcription": 0, "final": 1, "partial": 2}
+
+_HEADER = struct.Struct("<2sBBBHHfII4sI")
+_WORD = struct.Struct("<IIHB")
+
+
+def _milliseconds(seconds: Optional[float]) -> int:
+    return max(0, int(round((seconds or 0.0) * 1000)))
+
+
+def _probability(probability: Optional[float]) -> int:
+    # The Hugging Face Whisper backend has no word probabilities
+    if probability is None:
+        return 0xFFFF
+    return int(round(min(max(probability, 0.0), 1.0) * 65534))
+
+
+class ResultEncoder:
+
+    def __init__(self, encoding: str = "json", incremental_words: bool = False):
+        if encoding not in RESULT_ENCODINGS:
+            raise ValueError(f"Unsupported result encoding: {encoding}")
+
+        self.encoding = encoding
+        self.incremental_words = incremental_words
+        # Quantized (word, start_ms, end_ms) of the words of the last result of each channel, what "keep" refers to
+        self.previous_words: Dict[Optional[int], List[Tuple[str, int, int]]] = {}
+
+    async def send(self, websocket: WebSocket, result: Dict[str, Any]):
+        message = self.encode(result)
+        if isinstance(message, bytes):
+            await websocket.send_bytes(message)
+        else:
+            await websocket.send_text(message)
+
+    def encode(self, result: Dict[str, Any]) -> Union[str, bytes]:
+        words = result.get("words")
+        if not isinstance(words, list):
+            # HuggingFace Whisper has no word timestamps
+            words = []
+
+        keep = self.shared_prefix(words, result.get("channel")) if self.incremental_words else 0
+        if self.encoding == "json":
+            if not self.incremental_words:
+                return json.dumps(result)
+            return json.dumps({**result, "keep": keep, "words": words[keep:]})
+
+        if self.encoding == "msgpack":
+            return msgpack.packb({
+                **result,
+                "keep": keep,
+                "words": [
+                    [w["word"], _milliseconds(w["start"]), _milliseconds(w["end"]),
+                     round(w["probability"], 3) if w["probability"] is not None else None]
+                    for w in words[keep:]
+                ],
+            })
+
+        return self.encode_binary(result, words, keep)
+
+    def shared_prefix(self, words: List[Dict[str, Any]], channel: Optional[int] = None) -> int:
+        quantized = [(w["word"], _milliseconds(w["start"]), _milliseconds(w["end"])) for w in words]
+        previous_words = self.previous_words.get(channel, [])
+        keep = 0
+        while keep < min(len(quantized), len(previous_words)) and quantized[keep] == previous_words[keep]:
+            keep += 1
+        self.previous_words[channel] = quantized
+        return keep
+
+    @staticmethod
+    def encode_binary(result: Dict[str, Any], words: List[Dict[str, Any]], keep: int) -> bytes:
+        text = result.get("text", "").encode("utf-8")
+        parts = [_HEADER.pack(
+            b"TR",
+            BINARY_VERSION,
+            BINARY_MESSAGE_TYPES.get(result.get("type", "transcription"), 0),
+            result.get("channel") or 0,
+            keep,
+            len(words) - keep,
+            result.get("language_probability") or 0.0,
+            _milliseconds(result.get("processing_time")),
+            _milliseconds(result.get("audio_end")),
+            (result.get("language") or "").encode("ascii", "ignore")[:4],
+            len(text),
+        ), text]
+
+        for word in words[keep:]:
+            encoded_word = word["word"].encode("utf-8")[:255]
+            parts.append(_WORD.pack(_milliseconds(word["start"]), _milliseconds(word["end"]),
+                                    _probability(word["probability"]), len(encoded_word)))
+            parts.append(encoded_word)
+
+        return b"".join(parts)
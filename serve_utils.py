@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Any, Optional
+
+import ray
+
+from metrics import get_metrics
+
+logger = logging.getLogger("ray.serve")
+
+
+def parse_flag(value) -> bool:
+    """
+    Boolean of a deployment or strategy argument, or of the environment variable overriding it, where "0",
+    "false" and "no" are off
+    """
+    return str(value).lower() not in ("0", "false", "no", "")
+
+
+def get_assigned_cpus() -> int:
+    """
+    Number of CPUs Ray reserved for the current replica, 1 when running outside of Ray
+    """
+    if not ray.is_initialized():
+        return 1
+    return max(1, int(ray.get_runtime_context().get_assigned_resources().get("CPU", 1)))
+
+
+def get_rss_bytes() -> int:
+    """
+    Resident memory of the current process, the peak resident memory where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_process_age_seconds() -> Optional[float]:
+    """
+    Seconds since the current process started, None where /proc is not available
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesized command name which may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+class WarmupReadiness:
+    """
+    Deployment mixin for replicas that warm their model up in __init__. Ray Serve only routes to a replica once
+    __init__ returned, and check_health reports the replica unhealthy until warm_up succeeded.
+    """
+
+    ready: bool = False
+
+    def warm_up(self, name: str, init_start: float, warmup: Callable[[], Any]) -> float:
+        """
+        Runs the warmup, logs the time to ready since init_start and since the process started, returns the
+        seconds the warmup took
+        """
+        load_seconds = time.time() - init_start
+        warmup_start = time.time()
+        warmup()
+        warmup_seconds = time.time() - warmup_start
+        self.ready = True
+
+        process_age = get_process_age_seconds()
+        get_metrics().time_to_ready.set(load_seconds, tags={"stage": "load"})
+        get_metrics().time_to_ready.set(warmup_seconds, tags={"stage": "warmup"})
+        if process_age is not None:
+            get_metrics().time_to_ready.set(process_age, tags={"stage": "process"})
+        logger.info(f"{name} ready in {load_seconds + warmup_seconds:.2f}s (load {load_seconds:.2f}s, warmup "
+                    f"{warmup_seconds:.2f}s)" + (f", {process_age:.2f}s after the process started"
+                                                if process_age is not None else ""))
+        return warmup_seconds
+
+    def check_health(self):
+        if not self.ready:
+            raise RuntimeError(f"{type(self).__name__} has not finished warming up")
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for model calls, so a replica's event loop keeps serving health checks and queued
+    requests while inference runs. ctranslate2 and torch release the GIL, so calls in the pool overlap.
+    """
+
+    def __init__(self, pool_size: int, name: str):
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=name)
+        logger.info(f"{name} inference pool size: {pool_size}")
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
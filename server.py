@@ -1,6 +1,11 @@
+import base64
+import os
+
 import ray
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from ray import serve
+from ray.serve import Application
 from ray.serve.handle import DeploymentHandle
 
 import websockets
@@ -8,11 +13,17 @@ import uuid
 import json
 import asyncio
 import logging
+from typing import Dict, Any, Optional
 
+from admission_control import AdmissionController
 from audio_utils import save_audio_to_file
 from client import Client
-from asr.faster_whisper_asr import FasterWhisperASR
-from vad.pyannote_vad import PyannoteVAD
+from decode_profiles import DecodeProfiles, DEFAULT_DECODE_PROFILE
+from metrics import get_metrics
+from offline_transcription import OfflineTranscriber
+from asr.asr_factory import ASRFactory
+from asr.asr_model_registry import ASRModelRegistry
+from vad.vad_factory import VADFactory
 
 logger = logging.getLogger("ray.serve")
 logger.setLevel(logging.DEBUG)
@@ -24,24 +35,105 @@ app = FastAPI()
 class TranscriptionServer:
 
     def __init__(self, asr_handle: DeploymentHandle, vad_handle: DeploymentHandle, sampling_rate=16000,
-                 samples_width=2):
+                 samples_width=2, asr_models: Optional[Dict[str, DeploymentHandle]] = None, **kwargs):
         self.sampling_rate = sampling_rate
         self.samples_width = samples_width
         self.asr_handle = asr_handle
+        # Handles of the ASR model registry variants by name, asr_handle is the default one
+        self.asr_models = asr_models or {}
+        self.default_asr_model = kwargs.get("default_asr_model")
         self.vad_handle = vad_handle
         self.connected_clients = {}
 
+        max_sessions = os.environ.get("MAX_SESSIONS")
+        if not max_sessions:
+            max_sessions = kwargs.get("max_sessions")
+
+        max_inflight_asr_seconds = os.environ.get("MAX_INFLIGHT_ASR_SECONDS")
+        if not max_inflight_asr_seconds:
+            max_inflight_asr_seconds = kwargs.get("max_inflight_asr_seconds")
+
+        max_session_buffer_seconds = os.environ.get("MAX_SESSION_BUFFER_SECONDS")
+        if not max_session_buffer_seconds:
+            max_session_buffer_seconds = kwargs.get("max_session_buffer_seconds")
+
+        buffer_policy = os.environ.get("BUFFER_POLICY")
+        if not buffer_policy:
+            buffer_policy = kwargs.get("buffer_policy", "drop_oldest")
+
+        ring_buffer_seconds = os.environ.get("RING_BUFFER_SECONDS")
+        if not ring_buffer_seconds:
+            ring_buffer_seconds = kwargs.get("ring_buffer_seconds", 60.0)
+
+        max_channels = os.environ.get("MAX_CHANNELS")
+        if not max_channels:
+            max_channels = kwargs.get("max_channels", 2)
+
+        self.admission_controller = AdmissionController(
+            max_sessions=int(max_sessions) if max_sessions else None,
+            max_inflight_asr_seconds=float(max_inflight_asr_seconds) if max_inflight_asr_seconds else None,
+            max_session_buffer_seconds=float(max_session_buffer_seconds) if max_session_buffer_seconds else None,
+            buffer_policy=buffer_policy,
+            ring_buffer_seconds=float(ring_buffer_seconds),
+            max_channels=int(max_channels),
+        )
+
+        default_decode_profile = os.environ.get("DEFAULT_DECODE_PROFILE")
+        if not default_decode_profile:
+            default_decode_profile = kwargs.get("default_decode_profile", DEFAULT_DECODE_PROFILE)
+
+        max_beam_size = os.environ.get("MAX_BEAM_SIZE")
+        if not max_beam_size:
+            max_beam_size = kwargs.get("max_beam_size", 5)
+
+        self.decode_profiles = DecodeProfiles(
+            default_profile=default_decode_profile,
+            allowed_profiles=kwargs.get("allowed_decode_profiles"),
+            max_beam_size=int(max_beam_size),
+            max_best_of=int(kwargs.get("max_best_of", 5)),
+            max_temperature_fallbacks=int(kwargs.get("max_temperature_fallbacks", 5)),
+        )
+
+        max_concurrent_segments = os.environ.get("OFFLINE_MAX_CONCURRENT_SEGMENTS")
+        if not max_concurrent_segments:
+            max_concurrent_segments = kwargs.get("offline_max_concurrent_segments", 64)
+
+        max_segment_seconds = os.environ.get("OFFLINE_MAX_SEGMENT_SECONDS")
+        if not max_segment_seconds:
+            max_segment_seconds = kwargs.get("offline_max_segment_seconds", 28.0)
+
+        self.offline_transcriber = OfflineTranscriber(
+            vad_handle, asr_handle, self.admission_controller, asr_models=self.asr_models,
+            sampling_rate=sampling_rate,
+            max_segment_seconds=float(max_segment_seconds),
+            max_concurrent_segments=int(max_concurrent_segments),
+            max_jobs=int(kwargs.get("offline_max_jobs", 100)),
+        )
+
     async def handle_audio(self, client: Client, websocket: WebSocket):
         while True:
             message = await websocket.receive()
 
             if "bytes" in message.keys():
-                client.append_audio_data(message["bytes"])
+                control_message = client.append_audio_data(message["bytes"])
+                if control_message is not None:
+                    await websocket.send_text(json.dumps(control_message))
             elif "text" in message.keys():
                 config = json.loads(message["text"])
                 if config.get("type") == "config":
-                    client.update_config(config["data"])
+                    try:
+                        self.get_asr_handle(config["data"].get("asr_model"))
+                        client.update_config(config["data"])
+                    except ValueError as e:
+                        # The session carries on with its previous config
+                        logger.warning(f"Rejected config from {client.client_id}: {e}")
+                        await websocket.send_text(json.dumps({"type": "status", "status": "rejected",
+                                                              "reason": str(e)}))
                     continue
+                if config.get("type") == "end_of_stream":
+                    control_message = client.end_stream()
+                    if control_message is not None:
+                        await websocket.send_text(json.dumps(control_message))
             elif message["type"] == "websocket.disconnect":
                 raise WebSocketDisconnect
             else:
@@ -49,28 +141,147 @@ class TranscriptionServer:
                 logger.debug(
                     f"{type(message)} is not a valid message type. Type is {message['type']}; keys: {json.dumps(keys_list)}")
                 logger.error(f"Unexpected message type from {client.client_id}")
-            client.process_audio(websocket, self.vad_handle, self.asr_handle)
+            client.process_audio(websocket, self.vad_handle, self.get_asr_handle(client.config["asr_model"]))
 
     @app.websocket("/")
     async def handle_websocket(self, websocket: WebSocket):
         await websocket.accept()
 
+        rejection_reason = self.admission_controller.try_admit()
+        if rejection_reason is not None:
+            logger.warning(f"Refusing connection: {rejection_reason}")
+            await websocket.send_text(json.dumps({"type": "status", "status": "rejected", "reason": rejection_reason}))
+            # 1013: Try Again Later
+            await websocket.close(code=1013)
+            return
+
         client_id = str(uuid.uuid4())
-        client = Client(client_id, self.sampling_rate, self.samples_width)
+        client = Client(client_id, self.sampling_rate, self.samples_width, self.admission_controller,
+                        self.decode_profiles)
         self.connected_clients[client_id] = client
+        self.update_session_metrics()
 
-        logger.info(f"Client {client_id} connected")
+        logger.info(f"Client {client_id} connected, {client.memory_bytes / 1024:.0f}KiB audio buffer")
 
         try:
             await self.handle_audio(client, websocket)
         except WebSocketDisconnect as e:
             logger.warning(f"Connection with {client_id} closed")
         finally:
+            client.close()
             del self.connected_clients[client_id]
+            self.admission_controller.release()
+            self.update_session_metrics()
+
+    def get_asr_handle(self, asr_model: Optional[str]) -> DeploymentHandle:
+        if asr_model is None:
+            return self.asr_handle
+        if asr_model not in self.asr_models:
+            raise ValueError(f"Unknown ASR model: {asr_model}")
+        return self.asr_models[asr_model]
+
+    def update_session_metrics(self):
+        get_metrics().active_sessions.set(len(self.connected_clients))
+        get_metrics().session_memory_bytes.set(sum(c.memory_bytes for c in self.connected_clients.values()))
+
+    @app.get("/models")
+    async def list_models(self):
+        """
+        The ASR model variants with the memory and chunk latency one of their replicas measured at startup
+        """
+        models = self.asr_models or {"default": self.asr_handle}
+        details = await asyncio.gather(*(handle.describe.remote() for handle in models.values()))
+        return {"default": self.default_asr_model, "models": dict(zip(models, details))}
+
+    @app.post("/transcriptions")
+    async def create_transcription(self, request: Request):
+        """
+        Starts an offline transcription job. The body is either one audio file in any format FFmpeg reads, or
+        JSON {"files": [{"name": ..., "audio": <base64>}, ...], "language": ..., "decode_profile": ...} for
+        several files.
+        """
+        language = request.query_params.get("language")
+        asr_model = request.query_params.get("asr_model")
+        decode_profile = request.query_params.get("decode_profile")
+        decode_overrides = None
+        if request.headers.get("content-type", "").startswith("application/json"):
+            body = await request.json()
+            language = body.get("language", language)
+            decode_profile = body.get("decode_profile", decode_profile)
+            asr_model = body.get("asr_model", asr_model)
+            decode_overrides = body.get("decode_options")
+            try:
+                files = [(f.get("name", f"file_{i}"), base64.b64decode(f["audio"])) for i, f in enumerate(body["files"])]
+            except (KeyError, TypeError, ValueError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid files: {e}")
+        else:
+            files = [(request.query_params.get("file_name", "audio"), await request.body())]
+
+        if not files or not all(data for _, data in files):
+            raise HTTPException(status_code=400, detail="No audio in request")
+
+        try:
+            decode_options = self.decode_profiles.resolve(decode_profile, decode_overrides)
+            self.get_asr_handle(asr_model)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        job = self.offline_transcriber.submit(files, language, decode_options, asr_model)
+        logger.info(f"Offline transcription job {job.job_id} started for {len(files)} file(s)")
+        return JSONResponse(job.to_dict(), status_code=202)
+
+    @app.get("/transcriptions/{job_id}")
+    async def get_transcription(self, job_id: str):
+        return self.get_job(job_id).to_dict()
+
+    @app.get("/transcriptions/{job_id}/events")
+    async def stream_transcription(self, job_id: str):
+        """
+        Streams the job's progress as newline-delimited JSON, the last line holds the results
+        """
+        job = self.get_job(job_id)
+
+        async def events():
+            while job.status not in ("completed", "failed"):
+                updated = job.updated
+                yield json.dumps(job.progress()) + "\n"
+                await updated.wait()
+            yield json.dumps(job.to_dict()) + "\n"
+
+        return StreamingResponse(events(), media_type="application/x-ndjson")
+
+    def get_job(self, job_id: str):
+        job = self.offline_transcriber.get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job
+
+
+def build_app(args: Dict[str, Any]) -> Application:
+    """
+    Application builder for serve_config.yaml, args holds the constructor arguments of each deployment
+    """
+    asr_type = args.get("asr_type", os.environ.get("ASR_TYPE", "faster_whisper"))
+    vad_type = args.get("vad_type", os.environ.get("VAD_TYPE", "pyannote"))
+    vad_app = VADFactory.create_vad_pipeline(vad_type, **args.get("vad_args", {}))
+    if "asr_models" not in args:
+        return TranscriptionServer.bind(ASRFactory.create_asr_pipeline(asr_type, **args.get("asr_args", {})),
+                                        vad_app, **args.get("server_args", {}))
+
+    registry = ASRModelRegistry.from_config(args["asr_models"], asr_type, args.get("asr_args", {}))
+    asr_apps = registry.build()
+    return TranscriptionServer.bind(asr_apps[registry.default], vad_app, asr_models=asr_apps,
+                                    default_asr_model=registry.default, **args.get("server_args", {}))
+
 
+def __getattr__(name: str):
+    # entrypoint is built on first access, importing this module, as every replica of the ingress does, must not
+    # import the default ASR and VAD backends
+    if name == "entrypoint":
+        return build_app({})
+    raise AttributeError(f"module {__name__} has no attribute {name}")
 
-entrypoint = TranscriptionServer.bind(FasterWhisperASR.bind(), PyannoteVAD.bind())
 
 if __name__ == "__main__":
     ray.init()
-    serve.run(entrypoint, name="transcription-service", route_prefix="/")
+    serve.run(build_app({}), name="transcription-service", route_prefix="/")
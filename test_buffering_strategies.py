@@ -0,0 +1,156 @@
+"""
+Buffering strategies driven with fake VAD and ASR handles, without a running service.
+"""
+import asyncio
+import json
+
+import numpy as np
+
+from client import Client
+
+SAMPLING_RATE = 16000
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+class FakeMethod:
+
+    def __init__(self, function):
+        self.function = function
+
+    def remote(self, *args):
+        return self.function(*args)
+
+
+class FakeVAD:
+
+    def __init__(self, speech_to_end: bool = False):
+        # Cleared to hold every VAD call until the test sets it
+        self.released = asyncio.Event()
+        self.released.set()
+        # Speech runs to the end of every chunk, an utterance without a pause
+        self.speech_to_end = speech_to_end
+        self.detect_activity = FakeMethod(self._detect_activity)
+
+    async def _detect_activity(self, request):
+        await self.released.wait()
+        if self.speech_to_end:
+            return [{"start": 0.0, "end": request.num_samples / request.sampling_rate}]
+        return [{"start": 0.0, "end": 0.2}]
+
+
+class FakeASR:
+
+    def __init__(self, channel_languages=("en",)):
+        # Language the ASR detects on each channel
+        self.channel_languages = channel_languages
+        self.audio_seconds = []
+        self.requests = []
+        self.transcribe = FakeMethod(self._transcribe)
+        self.transcribe_channels = FakeMethod(self._transcribe_channels)
+
+    async def _transcribe(self, request, channel=0):
+        self.audio_seconds.append(request.num_samples / request.sampling_rate)
+        self.requests.append(request)
+        language = request.language or self.channel_languages[channel]
+        return {"text": "hello", "words": [], "language": language, "language_probability": 1.0}
+
+    async def _transcribe_channels(self, requests):
+        return [await self._transcribe(request, channel) for channel, request in enumerate(requests)]
+
+
+def create_client(**processing_args) -> Client:
+    client = Client("test", SAMPLING_RATE, 2)
+    client.update_config({"language": "en", "processing_args": {
+        "chunk_length_seconds": 1, "chunk_offset_seconds": 0.1, "object_store_threshold_bytes": 2 ** 30,
+        **processing_args,
+    }})
+    return client
+
+
+def audio(seconds: float) -> bytes:
+    return (np.random.default_rng(0).normal(0, 3000, int(seconds * SAMPLING_RATE))).astype(np.int16).tobytes()
+
+
+def test_end_of_stream_with_a_full_pipeline_transcribes_the_tail():
+    async def session():
+        client = create_client(pipeline_depth=1)
+        websocket, vad, asr = FakeWebSocket(), FakeVAD(), FakeASR()
+        vad.released.clear()
+
+        # The first chunk waits in VAD and the second fills the queue
+        for seconds in (1.5, 1.5):
+            client.append_audio_data(audio(seconds))
+            client.process_audio(websocket, vad, asr)
+            await asyncio.sleep(0)
+        client.append_audio_data(audio(2.5))
+        client.end_stream()
+        client.process_audio(websocket, vad, asr)
+        assert client.buffering_strategy.end_of_stream
+
+        vad.released.set()
+        for _ in range(100):
+            await asyncio.sleep(0)
+        client.close()
+        return client, websocket, asr
+
+    client, websocket, asr = asyncio.run(session())
+
+    assert asr.audio_seconds == [1.5, 1.5, 2.5]
+    assert len(websocket.sent) == 3
+    assert client.pending_samples == 0
+    assert client.scratch_samples == 0
+
+
+def test_utterance_longer_than_the_ring_buffer_is_cut_without_dropping_audio():
+    async def session():
+        client = create_client()
+        websocket, vad, asr = FakeWebSocket(), FakeVAD(speech_to_end=True), FakeASR()
+
+        # A 75s monologue in 0.5s messages, longer than the 60s ring buffer
+        for _ in range(150):
+            client.append_audio_data(audio(0.5))
+            client.process_audio(websocket, vad, asr)
+            for _ in range(10):
+                await asyncio.sleep(0)
+        client.end_stream()
+        client.process_audio(websocket, vad, asr)
+        for _ in range(100):
+            await asyncio.sleep(0)
+        client.close()
+        return client, asr
+
+    client, asr = asyncio.run(session())
+
+    assert client.dropped_samples == 0
+    assert sum(asr.audio_seconds) == 75
+    assert max(asr.audio_seconds) <= client.admission_controller.ring_buffer_seconds / 2 + 1
+
+
+def test_each_channel_locks_its_own_language():
+    async def session():
+        client = create_client()
+        client.update_config({"language": None, "channels": 2})
+        websocket, vad, asr = FakeWebSocket(), FakeVAD(), FakeASR(channel_languages=("en", "de"))
+
+        for _ in range(2):
+            # Interleaved frames of both channels
+            client.append_audio_data(audio(2 * 1.5))
+            client.process_audio(websocket, vad, asr)
+            for _ in range(100):
+                await asyncio.sleep(0)
+        client.close()
+        return websocket, asr
+
+    websocket, asr = asyncio.run(session())
+
+    assert [request.language for request in asr.requests] == [None, None, "en", "de"]
+    language_messages = [message for message in websocket.sent if message.get("type") == "language"]
+    assert [(message["channel"], message["language"]) for message in language_messages] == [(0, "en"), (1, "de")]
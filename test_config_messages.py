@@ -0,0 +1,86 @@
+"""
+Config message handling of the websocket loop, run against a fake websocket without a running service.
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from client import Client
+from server import TranscriptionServer
+
+
+class FakeWebSocket:
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def receive(self):
+        if not self.messages:
+            return {"type": "websocket.disconnect"}
+        return self.messages.pop(0)
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def config_message(data):
+    return {"type": "websocket.receive", "text": json.dumps({"type": "config", "data": data})}
+
+
+def run_session(messages):
+    server = TranscriptionServer.func_or_class(asr_handle=None, vad_handle=None)
+    client = Client("test", server.sampling_rate, server.samples_width, server.admission_controller,
+                    server.decode_profiles)
+    websocket = FakeWebSocket(messages)
+    with pytest.raises(WebSocketDisconnect):
+        asyncio.run(server.handle_audio(client, websocket))
+    client.close()
+    return client, websocket
+
+
+def test_bad_config_is_rejected_and_a_good_one_applies():
+    client, websocket = run_session([
+        config_message({"language": "fr", "decode_profile": "unknown"}),
+        config_message({"language": "de"}),
+    ])
+
+    assert len(websocket.sent) == 1
+    assert websocket.sent[0]["type"] == "status"
+    assert websocket.sent[0]["status"] == "rejected"
+    assert "unknown" in websocket.sent[0]["reason"]
+    # Nothing of the rejected message was applied
+    assert client.config["decode_profile"] is None
+    assert client.config["language"] == "de"
+
+
+def test_unknown_asr_model_is_rejected():
+    client, websocket = run_session([config_message({"asr_model": "huge"}), config_message({"language": "de"})])
+
+    assert [message["status"] for message in websocket.sent] == ["rejected"]
+    assert "huge" in websocket.sent[0]["reason"]
+    assert client.config["asr_model"] is None
+    assert client.config["language"] == "de"
+
+
+def test_channel_limit_is_rejected():
+    client, websocket = run_session([config_message({"channels": 8}), config_message({"result_encoding": "msgpack"})])
+
+    assert [message["status"] for message in websocket.sent] == ["rejected"]
+    assert client.channels == 1
+    assert client.config["channels"] == 1
+    assert client.result_encoder.encoding == "msgpack"
+
+
+def test_locked_language_survives_unrelated_config():
+    client = Client("test", 16000, 2)
+    client.observe_language({"language": "de", "language_probability": 0.95}, None)
+
+    client.update_config({"result_encoding": "msgpack", "decode_profile": "fast"})
+    assert client.request_language() == "de"
+
+    client.update_config({"language_lock_threshold": 0.9})
+    assert client.request_language() is None
+    client.close()
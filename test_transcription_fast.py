@@ -86,6 +86,8 @@ async def test_transcription(audio_file_path: str, uri="ws://localhost:8000/", l
                     # Simulate real-time: 1 second of audio sent over 1 second
                     await asyncio.sleep(1.0)  # Real-time delay
 
+                # Transcribe the rest of the buffer even when it is shorter than a chunk
+                await websocket.send(json.dumps({"type": "end_of_stream"}))
                 print(f"✓ All audio sent")
                 all_audio_sent.set()
 
@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import pickle
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+import ray
+
+from metrics import get_metrics
+
+logger = logging.getLogger("ray.serve")
+
+CACHE_ACTOR_NAMESPACE = "transcription-service"
+
+
+class LRUBytesCache:
+    """
+    LRU map of keys to pickled values, bounded by the total size of the values
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.size_bytes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size_bytes -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.size_bytes += len(value)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+
+
+@ray.remote(num_cpus=0)
+class TranscriptionCacheActor:
+    """
+    Cluster-wide tier of the transcription cache, shared by every ASR replica that names it
+    """
+
+    def __init__(self, max_bytes: int):
+        self.cache = LRUBytesCache(max_bytes)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.cache.get(key)
+
+    def put(self, key: str, value: bytes):
+        self.cache.put(key, value)
+
+
+class TranscriptionCache:
+    """
+    Content-addressed cache of ASR results for repeated audio such as IVR prompts and greetings. Results are
+    keyed by a hash of the audio and of everything else that changes the output, kept in a per-replica LRU
+    and, when actor_name is set, in a named actor shared across the cluster.
+    """
+
+    def __init__(self, max_bytes: int, actor_name: Optional[str] = None, actor_max_bytes: Optional[int] = None):
+        self.local = LRUBytesCache(max_bytes)
+        self.actor = None
+        if actor_name:
+            self.actor = TranscriptionCacheActor.options(
+                name=actor_name, namespace=CACHE_ACTOR_NAMESPACE, get_if_exists=True, lifetime="detached",
+            ).remote(actor_max_bytes or max_bytes)
+
+    @staticmethod
+    def key(audio: np.ndarray, **options) -> str:
+        digest = hashlib.blake2b(np.ascontiguousarray(audio).view(np.uint8), digest_size=16)
+        digest.update(repr(sorted(options.items())).encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.local.get(key)
+        if value is not None:
+            get_metrics().cache_requests.inc(tags={"tier": "local", "outcome": "hit"})
+            return pickle.loads(value)
+        get_metrics().cache_requests.inc(tags={"tier": "local", "outcome": "miss"})
+
+        if self.actor is None:
+            return None
+        try:
+            value = await self.actor.get.remote(key)
+        except Exception:
+            logger.exception("Failed reading the cluster transcription cache")
+            return None
+        get_metrics().cache_requests.inc(tags={"tier": "cluster", "outcome": "hit" if value is not None else "miss"})
+        if value is None:
+            return None
+        self.local.put(key, value)
+        return pickle.loads(value)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        value = pickle.dumps(result)
+        self.local.put(key, value)
+        if self.actor is not None:
+            # Fire and forget, a lost write only costs a future miss
+            self.actor.put.remote(key, value)
+        get_metrics().cache_bytes.set(self.local.size_bytes)
@@ -0,0 +1,94 @@
+import os
+import time
+from typing import List, Any, Dict
+
+import numpy as np
+from ray import serve
+
+from audio_request import AudioRequest
+from audio_utils import save_audio_to_file, float32_to_pcm
+from metrics import get_metrics
+from request_routing import PendingAudioStats, audio_seconds_router_config
+from serve_utils import parse_flag
+from vad.vad_interface import VADInterface
+
+
+class EnergyVADPipeline:
+    """
+    Framewise energy and spectral flatness speech detection. A frame is speech when it is louder than both
+    energy_threshold_db and the estimated noise floor plus noise_floor_margin_db, and its spectrum is peaky
+    enough (flatness below flatness_threshold, white noise is close to 1). Speech frames are extended by
+    hangover_seconds so short dips inside words do not split segments.
+    """
+
+    def __init__(self, frame_seconds: float = 0.02, energy_threshold_db: float = -50.0,
+                 noise_floor_margin_db: float = 10.0, flatness_threshold: float = 0.5,
+                 hangover_seconds: float = 0.2, min_duration_on: float = 0.3):
+        self.frame_seconds = frame_seconds
+        self.energy_threshold_db = energy_threshold_db
+        self.noise_floor_margin_db = noise_floor_margin_db
+        self.flatness_threshold = flatness_threshold
+        self.hangover_seconds = hangover_seconds
+        self.min_duration_on = min_duration_on
+
+    def speech_frames(self, audio: np.ndarray, sampling_rate: int) -> np.ndarray:
+        frame_length = int(self.frame_seconds * sampling_rate)
+        num_frames = len(audio) // frame_length
+        if num_frames == 0:
+            return np.zeros(0, dtype=bool)
+
+        frames = audio[:num_frames * frame_length].reshape(num_frames, frame_length)
+        energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+
+        spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame_length), axis=1)) ** 2 + 1e-10
+        flatness = np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1)
+
+        noise_floor_db = np.percentile(energy_db, 10)
+        threshold_db = max(self.energy_threshold_db, noise_floor_db + self.noise_floor_margin_db)
+        speech = (energy_db > threshold_db) & (flatness < self.flatness_threshold)
+
+        hangover_frames = int(self.hangover_seconds / self.frame_seconds)
+        if hangover_frames > 0:
+            speech = np.convolve(speech, np.ones(hangover_frames + 1), mode="full")[:num_frames] > 0
+
+        return speech
+
+    def __call__(self, audio: np.ndarray, sampling_rate: int) -> List[Dict[str, Any]]:
+        speech = self.speech_frames(audio, sampling_rate)
+        edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        return [
+            {"start": float(start * self.frame_seconds), "end": float(end * self.frame_seconds), "confidence": 1.0}
+            for start, end in zip(starts, ends)
+            if (end - start) * self.frame_seconds >= self.min_duration_on
+        ]
+
+
+@serve.deployment(
+    ray_actor_options={"num_cpus": 1},
+    request_router_config=audio_seconds_router_config(),
+)
+class EnergyVAD(PendingAudioStats, VADInterface):
+
+    def __init__(self, **kwargs):
+        self.vad_pipeline = EnergyVADPipeline(**kwargs.get("energy_args", {}))
+
+        self.save_audio_debug = os.environ.get("SAVE_AUDIO_DEBUG")
+        if not self.save_audio_debug:
+            self.save_audio_debug = kwargs.get("save_audio_debug", False)
+        self.save_audio_debug = parse_flag(self.save_audio_debug)
+
+    async def detect_activity(self, request: AudioRequest) -> List[Any]:
+        request.validate()
+        async with self.pending_audio(request.audio_seconds):
+            audio = await request.get_audio()
+            if self.save_audio_debug:
+                await save_audio_to_file(float32_to_pcm(audio), request.file_name)
+
+            start = time.time()
+            vad_segments = self.vad_pipeline(audio, request.sampling_rate)
+            get_metrics().observe_inference("vad_inference", "energy", time.time() - start,
+                                            len(audio) / request.sampling_rate)
+            return vad_segments
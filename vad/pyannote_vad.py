@@ -1,10 +1,16 @@
 import os
+import time
+
+import numpy as np
 import torch
 from pyannote.audio import Model
 from pyannote.audio.pipelines import VoiceActivityDetection
 
-from audio_utils import save_audio_to_file
-# from client import Client
+from audio_request import AudioRequest
+from audio_utils import save_audio_to_file, float32_to_pcm, warmup_audio
+from metrics import get_metrics
+from request_routing import PendingAudioStats, audio_seconds_router_config
+from serve_utils import InferenceExecutor, WarmupReadiness, get_assigned_cpus, parse_flag
 from vad.vad_interface import VADInterface
 
 from typing import List, Any
@@ -13,11 +19,13 @@ from ray import serve
 
 
 @serve.deployment(
-    ray_actor_options={"num_cpus": 1}
+    ray_actor_options={"num_cpus": 1},
+    request_router_config=audio_seconds_router_config(),
 )
-class PyannoteVAD(VADInterface):
+class PyannoteVAD(WarmupReadiness, PendingAudioStats, VADInterface):
 
     def __init__(self, **kwargs):
+        init_start = time.time()
         model_name = kwargs.get("model_name", "pyannote/segmentation")
         auth_token = os.environ.get("PYANNOTE_AUTH_TOKEN")
 
@@ -30,15 +38,40 @@ class PyannoteVAD(VADInterface):
         pyannote_args = kwargs.get("pyannote_args",
                                    {"onset": 0.5, "offset": 0.5, "min_duration_on": 0.3, "min_duration_off": 0.3})
 
-        self.model = Model.from_pretrained(model_name, use_auth_token=auth_token)
+        inference_pool_size = kwargs.get("inference_pool_size", get_assigned_cpus())
+        torch.set_num_threads(kwargs.get("cpu_threads", max(1, get_assigned_cpus() // inference_pool_size)))
+        self.executor = InferenceExecutor(inference_pool_size, "PyannoteVAD")
+
+        model_cache_dir = os.environ.get("MODEL_CACHE_DIR")
+        if not model_cache_dir:
+            model_cache_dir = kwargs.get("model_cache_dir")
+
+        self.model = Model.from_pretrained(model_name, use_auth_token=auth_token, cache_dir=model_cache_dir)
         self.model.to(torch.device("cpu"))
         self.vad_pipeline = VoiceActivityDetection(segmentation=self.model)
         self.vad_pipeline.instantiate(pyannote_args)
 
-    async def detect_activity(self, client) -> List[Any]:
-        filepath = await save_audio_to_file(client.scratch_buffer, client.get_file_name())
-        vad_results = self.vad_pipeline(filepath)
-        os.remove(filepath)
+        self.save_audio_debug = os.environ.get("SAVE_AUDIO_DEBUG")
+        if not self.save_audio_debug:
+            self.save_audio_debug = kwargs.get("save_audio_debug", False)
+        self.save_audio_debug = parse_flag(self.save_audio_debug)
+
+        self.warm_up("PyannoteVAD", init_start, lambda: self._detect_activity(warmup_audio(3.0), 16000))
+
+    async def detect_activity(self, request: AudioRequest) -> List[Any]:
+        request.validate()
+        async with self.pending_audio(request.audio_seconds):
+            audio = await request.get_audio()
+            if self.save_audio_debug:
+                await save_audio_to_file(float32_to_pcm(audio), request.file_name)
+
+            return await self.executor.run(self._detect_activity, audio, request.sampling_rate)
+
+    def _detect_activity(self, audio: np.ndarray, sampling_rate: int) -> List[Any]:
+        start = time.time()
+        waveform = torch.from_numpy(audio).unsqueeze(0)
+        vad_results = self.vad_pipeline({"waveform": waveform, "sample_rate": sampling_rate})
+        get_metrics().observe_inference("vad_inference", "pyannote", time.time() - start, len(audio) / sampling_rate)
         vad_segments = []
         if len(vad_results) > 0:
             vad_segments = [
@@ -0,0 +1,62 @@
+from typing import List, Any, Dict, Optional
+
+import numpy as np
+from ray.serve.handle import DeploymentHandle
+
+from audio_request import AudioRequest
+
+
+class StreamingVAD:
+    """
+    Per-session VAD state kept on the ingress. Only audio that has not been through VAD yet, plus
+    context_seconds of already processed audio, is sent to the VAD deployment on each call, so the
+    cost of a call no longer grows with the scratch buffer. Segments are kept in absolute session time.
+    Multi-channel sessions keep one per channel.
+    """
+
+    def __init__(self, sampling_rate: int, context_seconds: float = 1.0, merge_gap_seconds: float = 0.3):
+        self.sampling_rate = sampling_rate
+        self.context_samples = int(context_seconds * sampling_rate)
+        self.merge_gap_seconds = merge_gap_seconds
+        self.processed_until = 0
+        self.segments: List[Dict[str, Any]] = []
+
+    async def detect_activity(self, client, vad_handle: DeploymentHandle, object_store_threshold_bytes: int,
+                              channel: Optional[int] = None) -> List[Dict[str, Any]]:
+        scratch_start = client.scratch_buffer_offset
+        scratch_end = client.scratch_end
+        window_start = max(scratch_start, self.processed_until - self.context_samples)
+
+        window = client.audio.view(window_start, scratch_end)
+        if channel is not None:
+            window = np.ascontiguousarray(window[:, channel])
+        request = AudioRequest.from_pcm(client, window, object_store_threshold_bytes)
+        window_segments = await vad_handle.detect_activity.remote(request)
+
+        self._merge(window_segments, window_start / self.sampling_rate)
+        self.processed_until = scratch_end
+
+        scratch_start_seconds = scratch_start / self.sampling_rate
+        self.segments = [segment for segment in self.segments if segment["end"] > scratch_start_seconds]
+        return list(self.segments)
+
+    def _merge(self, window_segments: List[Dict[str, Any]], window_start: float):
+        # Everything inside the window is decided again with the new audio as context
+        kept = []
+        for segment in self.segments:
+            if segment["start"] >= window_start:
+                continue
+            if segment["end"] > window_start:
+                segment = {**segment, "end": window_start}
+            kept.append(segment)
+
+        new_segments = [
+            {**segment, "start": segment["start"] + window_start, "end": segment["end"] + window_start}
+            for segment in window_segments
+        ]
+
+        if kept and new_segments and new_segments[0]["start"] - kept[-1]["end"] <= self.merge_gap_seconds:
+            kept[-1] = {**kept[-1], "end": new_segments[0]["end"]}
+            new_segments = new_segments[1:]
+
+        self.segments = kept + new_segments
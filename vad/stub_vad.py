@@ -0,0 +1,42 @@
+import asyncio
+import os
+import time
+
+from typing import List, Any
+
+from ray import serve
+
+from audio_request import AudioRequest
+from metrics import get_metrics
+from request_routing import PendingAudioStats, audio_seconds_router_config
+from vad.vad_interface import VADInterface
+
+
+@serve.deployment(
+    ray_actor_options={"num_cpus": 0.1},
+    request_router_config=audio_seconds_router_config(),
+)
+class StubVAD(PendingAudioStats, VADInterface):
+    """
+    Stand-in VAD with a fixed latency that reports the whole chunk as one speech segment followed by
+    trailing_silence_seconds of silence, so every buffered chunk is handed to the ASR
+    """
+
+    def __init__(self, **kwargs):
+        self.latency_seconds = float(os.environ.get("STUB_VAD_LATENCY_SECONDS") or kwargs.get("latency_seconds", 0.01))
+        self.trailing_silence_seconds = float(kwargs.get("trailing_silence_seconds", 0.5))
+
+    async def detect_activity(self, request: AudioRequest) -> List[Any]:
+        request.validate()
+        audio = await request.get_audio()
+        audio_seconds = len(audio) / request.sampling_rate
+
+        start = time.time()
+        async with self.pending_audio(audio_seconds):
+            await asyncio.sleep(self.latency_seconds)
+        get_metrics().observe_inference("vad_inference", "stub", time.time() - start, audio_seconds)
+
+        end = audio_seconds - self.trailing_silence_seconds
+        if end <= 0:
+            return []
+        return [{"start": 0.0, "end": end, "confidence": 1.0}]
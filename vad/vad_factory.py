@@ -1,12 +1,19 @@
-from vad.pyannote_vad import PyannoteVAD
-from vad.vad_interface import VADInterface
+from ray.serve import Application
 
 
 class VADFactory:
 
     @staticmethod
-    def create_vad_pipeline(type, **kwargs) -> VADInterface:
+    def create_vad_pipeline(type, **kwargs) -> Application:
+        # Backends are imported only when selected, pyannote pulls in torch
         if type == "pyannote":
-            return PyannoteVAD(**kwargs)
+            from vad.pyannote_vad import PyannoteVAD
+            return PyannoteVAD.bind(**kwargs)
+        elif type == "energy":
+            from vad.energy_vad import EnergyVAD
+            return EnergyVAD.bind(**kwargs)
+        elif type == "stub":
+            from vad.stub_vad import StubVAD
+            return StubVAD.bind(**kwargs)
         else:
             raise ValueError(f"Unknown vad type :{type}")
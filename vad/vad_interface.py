@@ -1,10 +1,9 @@
 from typing import List, Any
 
-
-# from client import Client
+from audio_request import AudioRequest
 
 
 class VADInterface:
 
-    async def detect_activity(self, client) -> List[Any]:
+    async def detect_activity(self, request: AudioRequest) -> List[Any]:
         raise NotImplementedError("Method should be implemented by subclasses")